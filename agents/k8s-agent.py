@@ -4,6 +4,7 @@ import os
 import sys
 import json
 import time
+import hashlib
 import logging
 import argparse
 import requests
@@ -11,6 +12,14 @@ import subprocess
 from datetime import datetime
 from pathlib import Path
 
+# PyYAML is optional; use the libyaml-backed loader when it is available
+try:
+    import yaml
+    YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
 # Setup logging
 LOG_DIR = os.path.expanduser("~/.nativeos/logs")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -21,6 +30,9 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Hashes of manifests from the last successful apply, per cluster and namespace
+APPLIED_CACHE_DIR = os.path.expanduser("~/.nativeos/cache/k8s/applied")
+
 class K8sAgent:
     def __init__(self):
         # API keys for different providers
@@ -454,6 +466,131 @@ Include ONLY valid Kubernetes YAML syntax and ensure all resources are properly
         
         return saved_files
     
+    def _file_sha256(self, file_path):
+        """Compute the SHA-256 digest of a file's contents."""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _applied_cache_path(self, namespace):
+        """Get the path of the applied-manifest hash cache for the current cluster and namespace."""
+        cluster = self.get_current_k8s_context() or "default"
+        key = "".join(c if c.isalnum() or c in "-_." else "_" for c in f"{cluster}-{namespace}")
+        return os.path.join(APPLIED_CACHE_DIR, f"{key}.json")
+    
+    def load_applied_hashes(self, namespace):
+        """Load the {filepath: sha256} map from the last successful apply."""
+        cache_path = self._applied_cache_path(namespace)
+        try:
+            with open(cache_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable apply cache {cache_path}: {str(e)}")
+            return {}
+    
+    def save_applied_hashes(self, namespace, hashes):
+        """Persist the {filepath: sha256} map after a successful apply."""
+        cache_path = self._applied_cache_path(namespace)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(hashes, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logging.warning(f"Failed to write apply cache {cache_path}: {str(e)}")
+    
+    def filter_unchanged_manifests(self, yaml_files, namespace, applied_hashes):
+        """Split manifests into those that need applying and those unchanged since the last apply.
+        
+        A file is skipped only if its hash matches the cache and its resources
+        still exist on the cluster. The existence check for all hash-matching
+        files is a single `kubectl get` call.
+        """
+        candidates = [
+            yaml_file for yaml_file in yaml_files
+            if applied_hashes.get(yaml_file) == self._file_sha256(yaml_file)
+        ]
+        if not candidates:
+            return list(yaml_files), []
+        
+        file_args = " ".join(f"-f {yaml_file}" for yaml_file in candidates)
+        if HAS_YAML:
+            exists_check = self.execute_command(
+                f"kubectl get {file_args} --namespace {namespace} --ignore-not-found -o name"
+            )
+            # `-o name` prints e.g. "deployment.apps/web"; reduce it to (kind, name)
+            present = set()
+            for line in exists_check["output"].splitlines() if exists_check["success"] else []:
+                resource, _, name = line.strip().partition("/")
+                if name:
+                    present.add((resource.split(".", 1)[0], name))
+            
+            unchanged = set()
+            for yaml_file in candidates:
+                objects = self._manifest_objects(yaml_file)
+                if objects and objects <= present:
+                    unchanged.add(yaml_file)
+        else:
+            # Objects can't be matched to files, but kubectl fails if any of them is missing
+            exists_check = self.execute_command(f"kubectl get {file_args} --namespace {namespace} -o name")
+            unchanged = set(candidates) if exists_check["success"] else set()
+        
+        changed = [yaml_file for yaml_file in yaml_files if yaml_file not in unchanged]
+        return changed, [yaml_file for yaml_file in yaml_files if yaml_file in unchanged]
+    
+    def _manifest_objects(self, yaml_file):
+        """Return the (lowercase kind, name) pairs a manifest defines, or None if they cannot be read."""
+        try:
+            with open(yaml_file, "r") as f:
+                documents = [doc for doc in yaml.load_all(f, Loader=YamlLoader) if doc is not None]
+        except (yaml.YAMLError, OSError):
+            return None
+        
+        objects = set()
+        for doc in documents:
+            if not isinstance(doc, dict):
+                return None
+            kind = doc.get("kind")
+            metadata = doc.get("metadata")
+            name = metadata.get("name") if isinstance(metadata, dict) else None
+            if not kind or not name:
+                return None
+            objects.add((str(kind).lower(), str(name)))
+        return objects
+    
+    def validate_manifest(self, yaml_file):
+        """Parse a manifest in-process and check each document has apiVersion and kind.
+        
+        Returns a (valid, message) tuple. Validation is skipped when PyYAML is not installed.
+        """
+        if not HAS_YAML:
+            return True, "PyYAML not installed, validation skipped"
+        
+        try:
+            with open(yaml_file, "r") as f:
+                documents = [doc for doc in yaml.load_all(f, Loader=YamlLoader) if doc is not None]
+        except yaml.YAMLError as e:
+            return False, f"Invalid YAML: {str(e)}"
+        except OSError as e:
+            return False, f"Could not read file: {str(e)}"
+        
+        if not documents:
+            return False, "No Kubernetes resources found"
+        
+        for index, doc in enumerate(documents):
+            if not isinstance(doc, dict):
+                return False, f"Document {index + 1} is not a mapping"
+            missing = [field for field in ("apiVersion", "kind") if not doc.get(field)]
+            if missing:
+                return False, f"Document {index + 1} is missing {', '.join(missing)}"
+        
+        return True, f"{len(documents)} resource(s) parsed"
+    
     def check_command_safety(self, command):
         """Check if a command is safe to execute."""
         # List of potentially dangerous commands
@@ -661,6 +798,21 @@ Include ONLY valid Kubernetes YAML syntax and ensure all resources are properly
                             print("\n❌ No YAML files found in the generated manifests")
                             return
                         
+                        # Validate manifests up front so bad files never reach kubectl
+                        valid_files = []
+                        for yaml_file in yaml_files:
+                            is_valid, message = self.validate_manifest(yaml_file)
+                            if is_valid:
+                                valid_files.append(yaml_file)
+                            else:
+                                logging.warning(f"Skipping invalid manifest {yaml_file}: {message}")
+                                print(f"❌ Skipping invalid manifest {os.path.basename(yaml_file)}: {message}")
+                        yaml_files = valid_files
+                        
+                        if not yaml_files:
+                            print("\n❌ No valid Kubernetes manifests to apply")
+                            return
+                        
                         # Ask for namespace
                         namespace = input("\nEnter the Kubernetes namespace (default: default): ") or "default"
                         
@@ -678,9 +830,16 @@ Include ONLY valid Kubernetes YAML syntax and ensure all resources are properly
                                 print("\nDeployment cancelled")
                                 return
                         
-                        # Apply each YAML file
+                        # Skip manifests that are byte-identical to the last successful apply
+                        applied_hashes = self.load_applied_hashes(namespace)
+                        pending_files, unchanged_files = self.filter_unchanged_manifests(yaml_files, namespace, applied_hashes)
+                        
+                        for yaml_file in unchanged_files:
+                            print(f"\nSkipping {os.path.basename(yaml_file)} (unchanged since last apply)")
+                        
+                        # Apply each changed YAML file
                         success_count = 0
-                        for yaml_file in yaml_files:
+                        for yaml_file in pending_files:
                             print(f"\nApplying {os.path.basename(yaml_file)}...")
                             apply_command = f"kubectl apply -f {yaml_file} --namespace {namespace}"
                             apply_result = self.execute_command(apply_command)
@@ -689,11 +848,15 @@ Include ONLY valid Kubernetes YAML syntax and ensure all resources are properly
                                 print(f"✅ Applied {os.path.basename(yaml_file)}")
                                 print(apply_result["output"])
                                 success_count += 1
+                                applied_hashes[yaml_file] = self._file_sha256(yaml_file)
                             else:
                                 print(f"❌ Failed to apply {os.path.basename(yaml_file)}")
                                 print(apply_result["output"])
+                                applied_hashes.pop(yaml_file, None)
+                        
+                        self.save_applied_hashes(namespace, applied_hashes)
                         
-                        print(f"\nApplied {success_count} out of {len(yaml_files)} manifest files")
+                        print(f"\nApplied {success_count} out of {len(pending_files)} changed manifest files ({len(unchanged_files)} unchanged)")
                         
                         # Get the deployment status
                         print("\nChecking deployment status...")
@@ -3,13 +3,29 @@
 import os
 import sys
 import json
+import re
 import time
+import hashlib
 import logging
+import functools
+import shlex
+import shutil
+import tempfile
 import argparse
 import requests
 import subprocess
+import concurrent.futures
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
-from pathlib import Path
+from pathlib import Path, PurePath
+
+# orjson is optional; fall back to the standard library when it is not installed
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 # Setup logging
 LOG_DIR = os.path.expanduser("~/.nativeos/logs")
@@ -20,53 +36,54 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
 
-class TerraformAgent:
-    def __init__(self):
-        # API keys for different providers
-        self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-        self.deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
-        
-        # Default to OpenAI if available
-        self.default_provider = os.getenv("NATIVE_OS_DEFAULT_PROVIDER", "openai").lower()
-        
-        # Check if we should use local model
-        self.use_local_model = os.getenv("NATIVE_OS_LOCAL_MODEL", "0") == "1" or (
-            self.openai_api_key is None and 
-            self.anthropic_api_key is None and 
-            self.deepseek_api_key is None
-        )
-        
-        # Configure infrastructure directory
-        self.infra_dir = os.path.join(os.getcwd(), "infra")
-        os.makedirs(self.infra_dir, exist_ok=True)
-    
-    def _get_ollama_response(self, prompt):
-        """Get response from local Ollama model."""
-        try:
-            # Check if Ollama is running
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={
-                    "model": "codellama",
-                    "prompt": prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                return response.json().get("response", "")
-            else:
-                logging.error(f"Ollama error: {response.text}")
-                return f"Error: Failed to get response from local model. Status code: {response.status_code}"
-        except Exception as e:
-            logging.exception("Error connecting to Ollama")
-            return f"Error: Could not connect to Ollama. Is it running? Error: {str(e)}"
-    
-    def _get_system_prompt(self):
-        """Get the standard system prompt for Terraform generation."""
-        return """You are an expert Terraform and infrastructure as code specialist created by hxcode ai. Generate production-ready Terraform files for cloud infrastructure deployments.
+def _json_dumps(obj):
+    """Serialize obj to compact UTF-8 JSON bytes with sorted keys."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def _json_loads(data):
+    """Deserialize JSON from bytes or str."""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Response cache for repeated prompts
+CACHE_DIR = os.path.expanduser("~/.nativeos/cache/terraform")
+CACHE_TTL = 24 * 60 * 60  # Seconds before a cached response expires
+
+# Provider plugins downloaded by `terraform init` are shared across projects
+PLUGIN_CACHE_DIR = os.path.expanduser("~/.nativeos/cache/terraform-plugins")
+
+# Hash of the last applied plan's change set, per project
+PLAN_CACHE_DIR = os.path.expanduser("~/.nativeos/cache/plans")
+
+# Matches a "## file: name" header, skips any prose up to the next code fence and
+# captures the fenced body. An unterminated final block runs to the end of the text.
+FILE_BLOCK_PATTERN = re.compile(
+    r"^## [Ff]ile:[ \t]*(?P<name>\S[^\n]*?)[ \t]*\n"
+    r"(?:(?!## [Ff]ile:)[^\n]*\n)*?"
+    r"[ \t]*```[^\n]*\n"
+    r"(?P<body>.*?)\n?(?:^[ \t]*```[ \t]*$|\Z)",
+    re.MULTILINE | re.DOTALL
+)
+
+# Potentially dangerous command fragments, compiled into one pattern so a command
+# is checked in a single scan
+DANGEROUS_PATTERNS = (
+    "rm -rf", "rmdir", "mkfs", 
+    "> /dev", "dd if", 
+    ":(){:|:&};:", "wget", "curl -o",
+    "sudo", "su"
+)
+DANGEROUS_PATTERN_RE = re.compile("|".join(re.escape(pattern) for pattern in DANGEROUS_PATTERNS))
+
+# The system prompt is sent byte-identical and first in every request so providers can
+# serve it from their prompt cache. Anything request-specific belongs at the END of
+# the user prompt, never in here.
+_SYSTEM_PROMPT = """You are an expert Terraform and infrastructure as code specialist created by hxcode ai. Generate production-ready Terraform files for cloud infrastructure deployments.
 
 Your capabilities:
 1. Create complete Terraform configurations for all major cloud providers
@@ -120,220 +137,488 @@ Format your response with file paths and code blocks:
 ```
 
 Include ONLY valid Terraform syntax and ensure all resources are properly configured with required attributes."""
+
+# Digest of the constant system prompt, folded into every response cache key
+_SYSTEM_PROMPT_SHA = hashlib.sha256(_SYSTEM_PROMPT.encode("utf-8")).digest()
+
+# The user prompt is split into an invariant prefix, which providers can cache, and a
+# per-request suffix that always comes last
+_PROMPT_PREFIX = """Generate Terraform files for the infrastructure request at the end of this message.
+
+Please provide:
+1. Complete Terraform configuration files (main.tf, variables.tf, outputs.tf, provider.tf)
+2. README.md with usage instructions and explanations
+3. Ensure all resources are properly configured with required attributes
+4. Use best practices for security, scalability, and maintainability
+"""
+
+_PROMPT_SUFFIX_TEMPLATE = """
+The files will be deployed in a project named '{project_name}'.
+
+Infrastructure request:
+{prompt}
+"""
+
+def cached(func):
+    """Cache a provider call on disk, keyed by provider, model, system prompt and user prompt."""
+    @functools.wraps(func)
+    def wrapper(self, provider, prompt, on_chunk=None):
+        if not self.use_cache:
+            return func(self, provider, prompt, on_chunk)
+        
+        key = self._cache_key(provider, PROVIDERS[provider]["model"], prompt)
+        response = self._cache_get(key)
+        if response is not None:
+            logger.info("Using cached %s response: %s", provider, key)
+            if on_chunk:
+                on_chunk(response)
+            return response
+        
+        response = func(self, provider, prompt, on_chunk)
+        # Never cache failures, they should be retried on the next run
+        if not response.startswith("Error:"):
+            self._cache_set(key, response)
+        return response
+    return wrapper
+
+def _openai_delta(event):
+    """Extract the text delta from an OpenAI-compatible streaming chunk."""
+    choices = event.get("choices") or [{}]
+    return choices[0].get("delta", {}).get("content")
+
+def _claude_delta(event):
+    """Extract the text delta from an Anthropic streaming event."""
+    if event.get("type") == "content_block_delta":
+        return event.get("delta", {}).get("text")
+    return None
+
+def _ollama_delta(event):
+    """Extract the text delta from an Ollama streaming event."""
+    return event.get("response")
+
+# Request settings for each provider. "format" selects how the payload is built and
+# how streamed events are decoded.
+PROVIDERS = {
+    "openai": {
+        "name": "OpenAI",
+        "url": "https://api.openai.com/v1/chat/completions",
+        "model": "gpt-3.5-turbo",  # Using gpt-3.5-turbo instead of gpt-4 for higher rate limits
+        "format": "openai",
+        "max_tokens": None
+    },
+    "claude": {
+        "name": "Claude",
+        "url": "https://api.anthropic.com/v1/messages",
+        "model": "claude-3-haiku-20240307",
+        "format": "anthropic",
+        "max_tokens": 4000
+    },
+    "deepseek": {
+        "name": "DeepSeek",
+        "url": "https://api.deepseek.com/v1/chat/completions",
+        "model": "deepseek-chat",
+        "format": "openai",
+        "max_tokens": 4000
+    },
+    "ollama": {
+        "name": "local model",
+        "url": "http://localhost:11434/api/generate",
+        "model": "codellama",
+        "format": "ollama",
+        "max_tokens": None
+    }
+}
+
+STREAM_DECODERS = {
+    "openai": _openai_delta,
+    "anthropic": _claude_delta,
+    "ollama": _ollama_delta
+}
+
+# Transient failures are retried by urllib3, honoring Retry-After on 429 responses
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["POST"],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+class FileStreamParser:
+    """Incrementally extract files from a streamed response.
+    
+    Text can be fed in arbitrary chunks. Each file is emitted as soon as the
+    code fence following its "## file:" header is closed.
+    """
+    SEEK_HEADER = "seek_header"
+    IN_CODE = "in_code"
     
-    def _get_openai_response(self, prompt):
-        """Get response from OpenAI API with retry logic for rate limits."""
-        max_retries = 3
-        retry_delay = 2  # Initial delay in seconds
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """Discard all parser state."""
+        self.state = self.SEEK_HEADER
+        self.buffer = ""
+        self.current_file = None
+        self.current_content = []
+    
+    def feed(self, text):
+        """Feed a chunk of text and yield each file it completes."""
+        lines = (self.buffer + text).split("\n")
+        # The last piece may be an incomplete line, keep it for the next chunk
+        self.buffer = lines.pop()
+        for line in lines:
+            file_info = self._process_line(line)
+            if file_info:
+                yield file_info
+    
+    def close(self):
+        """Flush any buffered input and yield files completed by it."""
+        if self.buffer:
+            file_info = self._process_line(self.buffer)
+            self.buffer = ""
+            if file_info:
+                yield file_info
+        # A file whose code block was never closed is still worth keeping
+        if self.state == self.IN_CODE and self.current_file:
+            yield self._finish_file()
+    
+    def _process_line(self, line):
+        if self.state == self.SEEK_HEADER:
+            if line.startswith("## file:") or line.startswith("## File:"):
+                self.current_file = line.split(":", 1)[1].strip()
+            elif self.current_file and line.strip().startswith("```"):
+                self.state = self.IN_CODE
+            return None
+        
+        if line.strip() == "```":
+            return self._finish_file()
+        self.current_content.append(line)
+        return None
+    
+    def _finish_file(self):
+        file_info = {
+            "filename": self.current_file,
+            "content": "\n".join(self.current_content)
+        }
+        self.state = self.SEEK_HEADER
+        self.current_file = None
+        self.current_content = []
+        return file_info
+
+class TerraformAgent:
+    def __init__(self):
+        # API keys for different providers
+        self.openai_api_key = os.getenv("OPENAI_API_KEY")
+        self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+        self.deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
         
-        for attempt in range(max_retries):
-            try:
-                headers = {
-                    "Authorization": f"Bearer {self.openai_api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                data = {
-                    "model": "gpt-3.5-turbo",  # Using gpt-3.5-turbo instead of gpt-4 for higher rate limits
-                    "messages": [
-                        {"role": "system", "content": self._get_system_prompt()},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.7
-                }
-                
-                response = requests.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=data
-                )
-                
-                if response.status_code == 200:
-                    return response.json()["choices"][0]["message"]["content"]
-                elif response.status_code == 429:
-                    # Rate limit hit - implement exponential backoff
-                    if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                        sleep_time = retry_delay * (2 ** attempt)
-                        logging.warning(f"Rate limit hit. Retrying in {sleep_time} seconds...")
-                        time.sleep(sleep_time)
-                        continue
-                    else:
-                        logging.error(f"OpenAI rate limit exceeded after {max_retries} attempts: {response.text}")
-                        return f"Error: OpenAI rate limit exceeded. Please try again later."
-                else:
-                    error_details = response.text
-                    logging.error(f"OpenAI error: {error_details}")
-                    # Print detailed error message for debugging
-                    print(f"\nOpenAI API Error (Status {response.status_code}):")
-                    print(f"Response: {error_details}")
-                    return f"Error: Failed to get response from OpenAI. Status code: {response.status_code}. Details: {error_details}"
-            except Exception as e:
-                logging.exception("Error connecting to OpenAI")
-                return f"Error: {str(e)}"
-        
-        return "Error: Maximum retries exceeded when contacting OpenAI API."
-        
-    def _get_claude_response(self, prompt):
-        """Get response from Claude (Anthropic) API with retry logic."""
-        max_retries = 3
-        retry_delay = 2  # Initial delay in seconds
-        
-        for attempt in range(max_retries):
-            try:
-                headers = {
-                    "x-api-key": f"{self.anthropic_api_key}",
-                    "anthropic-version": "2023-06-01",
-                    "Content-Type": "application/json"
-                }
-                
-                # Create the system prompt and user message
-                system_prompt = self._get_system_prompt()
-                
-                data = {
-                    "model": "claude-3-haiku-20240307",  # Use the latest Claude model
-                    "max_tokens": 4000,
-                    "temperature": 0.7,
-                    "system": system_prompt,
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ]
-                }
-                
-                response = requests.post(
-                    "https://api.anthropic.com/v1/messages",
-                    headers=headers,
-                    json=data
-                )
-                
-                if response.status_code == 200:
-                    return response.json()["content"][0]["text"]
-                elif response.status_code == 429:
-                    # Rate limit hit - implement exponential backoff
-                    if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                        sleep_time = retry_delay * (2 ** attempt)
-                        logging.warning(f"Claude rate limit hit. Retrying in {sleep_time} seconds...")
-                        time.sleep(sleep_time)
-                        continue
-                    else:
-                        logging.error(f"Claude rate limit exceeded after {max_retries} attempts: {response.text}")
-                        return f"Error: Claude rate limit exceeded. Please try again later."
-                else:
-                    logging.error(f"Claude error: {response.text}")
-                    return f"Error: Failed to get response from Claude. Status code: {response.status_code}"
-            except Exception as e:
-                logging.exception("Error connecting to Claude API")
-                return f"Error: {str(e)}"
-        
-        return "Error: Maximum retries exceeded when contacting Claude API."
-        
-    def _get_deepseek_response(self, prompt):
-        """Get response from DeepSeek API with retry logic."""
-        max_retries = 3
-        retry_delay = 2  # Initial delay in seconds
-        
-        for attempt in range(max_retries):
-            try:
-                headers = {
-                    "Authorization": f"Bearer {self.deepseek_api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                data = {
-                    "model": "deepseek-chat",  # Use DeepSeek chat model for infrastructure
-                    "messages": [
-                        {"role": "system", "content": self._get_system_prompt()},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 4000
-                }
-                
-                response = requests.post(
-                    "https://api.deepseek.com/v1/chat/completions",  
-                    headers=headers,
-                    json=data
-                )
-                
-                if response.status_code == 200:
-                    return response.json()["choices"][0]["message"]["content"]
-                elif response.status_code == 429:
-                    # Rate limit hit - implement exponential backoff
-                    if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                        sleep_time = retry_delay * (2 ** attempt)
-                        logging.warning(f"DeepSeek rate limit hit. Retrying in {sleep_time} seconds...")
-                        time.sleep(sleep_time)
-                        continue
-                    else:
-                        logging.error(f"DeepSeek rate limit exceeded after {max_retries} attempts: {response.text}")
-                        return f"Error: DeepSeek rate limit exceeded. Please try again later."
-                else:
-                    logging.error(f"DeepSeek error: {response.text}")
-                    return f"Error: Failed to get response from DeepSeek. Status code: {response.status_code}"
-            except Exception as e:
-                logging.exception("Error connecting to DeepSeek API")
-                return f"Error: {str(e)}"
+        # Default to OpenAI if available
+        self.default_provider = os.getenv("NATIVE_OS_DEFAULT_PROVIDER", "openai").lower()
+        
+        # Query the two preferred providers concurrently and keep the first good answer
+        self.race_providers = os.getenv("NATIVE_OS_RACE_PROVIDERS", "0") == "1"
         
-        return "Error: Maximum retries exceeded when contacting DeepSeek API."
+        # Check if we should use local model
+        self.use_local_model = os.getenv("NATIVE_OS_LOCAL_MODEL", "0") == "1" or (
+            self.openai_api_key is None and 
+            self.anthropic_api_key is None and 
+            self.deepseek_api_key is None
+        )
+        
+        # Configure infrastructure directory
+        self.infra_dir = os.path.join(os.getcwd(), "infra")
+        os.makedirs(self.infra_dir, exist_ok=True)
+        
+        # Configure response cache (set NATIVE_OS_CACHE=0 to always call the provider)
+        self.use_cache = os.getenv("NATIVE_OS_CACHE", "1") != "0"
+        if self.use_cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+        
+        # Shared HTTP session so connections to each provider are kept alive and reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=RETRY_POLICY)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        # Static headers and payload fields are built once per provider
+        self._request_templates = {provider: self._request_template(provider) for provider in PROVIDERS}
+    
+    def close(self):
+        """Close pooled HTTP connections."""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _cache_key(self, provider, model, prompt):
+        """Build a deterministic cache key for a provider request."""
+        return hashlib.sha256(_SYSTEM_PROMPT_SHA + _json_dumps([provider, model, prompt])).hexdigest()
+    
+    def _cache_get(self, key):
+        """Return a cached response if present and not expired, otherwise None."""
+        cache_path = os.path.join(CACHE_DIR, f"{key}.json")
+        try:
+            if time.time() - os.path.getmtime(cache_path) > CACHE_TTL:
+                return None
+            with open(cache_path, "rb") as f:
+                return _json_loads(f.read())["response"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable cache entry %s: %s", cache_path, e)
+            return None
+    
+    def _cache_set(self, key, response):
+        """Store a response in the cache."""
+        cache_path = os.path.join(CACHE_DIR, f"{key}.json")
+        try:
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_json_dumps({"response": response}))
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning("Failed to write cache entry %s: %s", cache_path, e)
+    
+    def _read_stream(self, response, extract_text, on_chunk=None):
+        """Accumulate text from a streamed (SSE or NDJSON) response.
+        
+        extract_text maps each decoded event to its text delta (or None);
+        every delta is passed to on_chunk as soon as it arrives.
+        """
+        parts = []
+        for line in response.iter_lines():
+            line = line.strip()
+            if not line or line.startswith((b"event:", b":")):
+                continue
+            if line.startswith(b"data:"):
+                line = line[len(b"data:"):].strip()
+                if line == b"[DONE]":
+                    break
+            
+            text = extract_text(_json_loads(line))
+            if text:
+                parts.append(text)
+                if on_chunk:
+                    on_chunk(text)
+        return "".join(parts)
+    
+    def _get_system_prompt(self):
+        """Get the standard system prompt for Terraform generation."""
+        return _SYSTEM_PROMPT
+    
+    def _request_template(self, provider):
+        """Build the parts of a provider request that do not depend on the prompt.
+        
+        Returns a (headers, payload, prefix_messages) tuple.
+        """
+        config = PROVIDERS[provider]
+        headers = {"Content-Type": "application/json"}
+        payload = {"model": config["model"], "stream": True}
+        prefix_messages = []
+        
+        if config["format"] == "ollama":
+            return headers, payload, prefix_messages
+        
+        if config["format"] == "anthropic":
+            headers["x-api-key"] = self.anthropic_api_key
+            headers["anthropic-version"] = "2023-06-01"
+            # Mark the system prompt as a cacheable prefix
+            payload["system"] = [{
+                "type": "text",
+                "text": self._get_system_prompt(),
+                "cache_control": {"type": "ephemeral"}
+            }]
+        else:
+            api_key = self.openai_api_key if provider == "openai" else self.deepseek_api_key
+            headers["Authorization"] = f"Bearer {api_key}"
+            prefix_messages.append({"role": "system", "content": self._get_system_prompt()})
+        
+        payload["temperature"] = 0.7
+        if config["max_tokens"]:
+            payload["max_tokens"] = config["max_tokens"]
+        return headers, payload, prefix_messages
+    
+    def _build_request(self, provider, prompt):
+        """Build the headers and JSON payload for a streaming request to a provider."""
+        headers, payload, prefix_messages = self._request_templates[provider]
+        
+        if PROVIDERS[provider]["format"] == "ollama":
+            return headers, {**payload, "prompt": prompt}
+        
+        # Mark the invariant prompt prefix as cacheable for Anthropic. OpenAI-compatible
+        # providers cache identical prefixes automatically.
+        if PROVIDERS[provider]["format"] == "anthropic" and prompt.startswith(_PROMPT_PREFIX):
+            content = [
+                {"type": "text", "text": _PROMPT_PREFIX, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt[len(_PROMPT_PREFIX):]}
+            ]
+            return headers, {**payload, "messages": [{"role": "user", "content": content}]}
+        
+        return headers, {
+            **payload,
+            "messages": prefix_messages + [{"role": "user", "content": prompt}]
+        }
+    
+    @cached
+    def _post_chat(self, provider, prompt, on_chunk=None):
+        """Get a streamed response from a provider. Retries are handled by the session."""
+        config = PROVIDERS[provider]
+        name = config["name"]
+        
+        try:
+            headers, data = self._build_request(provider, prompt)
+            response = self.session.post(
+                config["url"],
+                headers=headers,
+                data=_json_dumps(data),
+                stream=True
+            )
+            
+            if response.status_code == 200:
+                return self._read_stream(response, STREAM_DECODERS[config["format"]], on_chunk)
+            
+            error_details = response.text
+            logger.error("%s error (status %s): %s", name, response.status_code, error_details)
+            if response.status_code == 429:
+                return f"Error: {name} rate limit exceeded. Please try again later."
+            
+            # Print detailed error message for debugging
+            print(f"\n{name} API Error (Status {response.status_code}):")
+            print(f"Response: {error_details}")
+            return f"Error: Failed to get response from {name}. Status code: {response.status_code}. Details: {error_details}"
+        except Exception as e:
+            logger.exception("Error connecting to %s", name)
+            if provider == "ollama":
+                return f"Error: Could not connect to Ollama. Is it running? Error: {str(e)}"
+            return f"Error: {str(e)}"
+    
+    def _available_providers(self):
+        """List providers with API keys, preferred provider first."""
+        providers = [
+            ("openai", self.openai_api_key),
+            ("claude", self.anthropic_api_key),
+            ("deepseek", self.deepseek_api_key)
+        ]
+        available = [name for name, api_key in providers if api_key]
+        available.sort(key=lambda name: name != self.default_provider)
+        return available
+    
+    def _race_providers(self, providers, prompt):
+        """Query several providers concurrently and return the first successful response."""
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(providers))
+        futures = {executor.submit(self._post_chat, name, prompt): name for name in providers}
+        response = None
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    response = future.result()
+                    if not response.startswith("Error:"):
+                        logger.info("Using %s response (first to complete)", futures[future])
+                        return response
+                    logger.warning("%s failed: %s", futures[future], response)
+            return response
+        finally:
+            # Return without waiting for the slower provider. Its request is not cancelled: it
+            # keeps running in its worker (joined at interpreter exit) and its response is still
+            # cached, only its result is ignored here
+            executor.shutdown(wait=False)
+    
+    def _get_response(self, prompt, on_chunk=None, on_restart=None):
+        """Get a response from the configured model, falling back to other providers on failure.
+        
+        Streamed text is passed to on_chunk as it arrives. When falling back after a
+        failed attempt, on_restart is called first so partial output can be discarded.
+        Raced providers are not streamed.
+        """
+        if self.use_local_model:
+            logger.info("Using local Ollama model")
+            return self._post_chat("ollama", prompt, on_chunk)
+        
+        providers = self._available_providers()
+        if not providers:
+            return "Error: No AI provider available. Please set at least one API key for OpenAI, Claude, or DeepSeek."
+        
+        if self.race_providers and len(providers) > 1:
+            logger.info("Racing providers: %s", ", ".join(providers[:2]))
+            response = self._race_providers(providers[:2], prompt)
+            if not response.startswith("Error:"):
+                return response
+            providers = providers[2:]
+        
+        for name in providers:
+            logger.info("Using %s API", name)
+            response = self._post_chat(name, prompt, on_chunk)
+            if not response.startswith("Error:"):
+                return response
+            logger.warning("%s failed, trying next provider: %s", name, response)
+            if on_restart:
+                on_restart()
+        
+        return response
     
     def generate_terraform(self, prompt, project_name):
         """Generate Terraform files based on a given prompt."""
-        logging.info(f"Generating Terraform files for prompt: {prompt}")
+        logger.info("Generating Terraform files for prompt: %s", prompt)
         
         # Create project directory if it doesn't exist
         project_dir = os.path.join(self.infra_dir, project_name)
         os.makedirs(project_dir, exist_ok=True)
         
         # Enhance the prompt for better Terraform generation
-        enhanced_prompt = f"""
-        Generate Terraform files for the following infrastructure request:
-        
-        {prompt}
-        
-        Please provide:
-        1. Complete Terraform configuration files (main.tf, variables.tf, outputs.tf, provider.tf)
-        2. README.md with usage instructions and explanations
-        3. Ensure all resources are properly configured with required attributes
-        4. Use best practices for security, scalability, and maintainability
-        
-        The files will be deployed in a project named '{project_name}'.
-        """
-        
-        # Get response from the appropriate model
-        if self.use_local_model:
-            logging.info("Using local Ollama model")
-            response = self._get_ollama_response(enhanced_prompt)
-        else:
-            # Choose AI provider based on default_provider setting and available API keys
-            provider = self.default_provider
-            
-            if provider == "openai" and self.openai_api_key:
-                logging.info("Using OpenAI API")
-                response = self._get_openai_response(enhanced_prompt)
-            elif provider == "claude" and self.anthropic_api_key:
-                logging.info("Using Claude API")
-                response = self._get_claude_response(enhanced_prompt)
-            elif provider == "deepseek" and self.deepseek_api_key:
-                logging.info("Using DeepSeek API")
-                response = self._get_deepseek_response(enhanced_prompt)
-            else:
-                # Fallback to any available provider
-                if self.openai_api_key:
-                    logging.info("Falling back to OpenAI API")
-                    response = self._get_openai_response(enhanced_prompt)
-                elif self.anthropic_api_key:
-                    logging.info("Falling back to Claude API")
-                    response = self._get_claude_response(enhanced_prompt)
-                elif self.deepseek_api_key:
-                    logging.info("Falling back to DeepSeek API")
-                    response = self._get_deepseek_response(enhanced_prompt)
-                else:
-                    return "Error: No AI provider available. Please set at least one API key for OpenAI, Claude, or DeepSeek."
+        enhanced_prompt = _PROMPT_PREFIX + _PROMPT_SUFFIX_TEMPLATE.format(
+            project_name=project_name,
+            prompt=prompt
+        )
         
-        # Extract files from the response
-        files = self.extract_files(response)
+        # Parse the response while it streams in, saving each file as soon as it is complete.
+        # Files are staged next to the project and only moved into it once a provider has
+        # succeeded, so a failed attempt never overwrites or removes existing project files.
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.infra_dir)
+        parser = FileStreamParser()
+        files = []
+        streamed = []
+        
+        def on_chunk(text):
+            streamed.append(True)
+            for file_info in parser.feed(text):
+                self.save_files([file_info], staging_dir)
+                files.append(file_info)
+        
+        def on_restart():
+            # The fallback provider may use different file names; drop everything staged so far
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.makedirs(staging_dir, exist_ok=True)
+            parser.reset()
+            streamed.clear()
+            files.clear()
         
-        # Save the files
-        self.save_files(files, project_dir)
+        try:
+            # Get response from the appropriate model
+            response = self._get_response(enhanced_prompt, on_chunk, on_restart)
+            if response.startswith("Error:"):
+                return response
+            
+            remaining = list(parser.close())
+            
+            # Responses that were not streamed (e.g. raced providers) are parsed in one go
+            if not streamed:
+                remaining = self.extract_files(response)
+            
+            if remaining:
+                self.save_files(remaining, staging_dir)
+                files.extend(remaining)
+            
+            self._promote_staged_files(staging_dir, project_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
         
         return {
             "project_dir": project_dir,
@@ -341,101 +626,91 @@ Include ONLY valid Terraform syntax and ensure all resources are properly config
             "response": response
         }
     
+    def _promote_staged_files(self, staging_dir, project_dir):
+        """Move every file from the staging directory into the project directory."""
+        for root, _, names in os.walk(staging_dir):
+            target_dir = os.path.join(project_dir, os.path.relpath(root, staging_dir))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in names:
+                # Same filesystem, so each file replaces its counterpart atomically
+                os.replace(os.path.join(root, name), os.path.join(target_dir, name))
+    
     def extract_files(self, response):
         """Extract files from the generated response."""
-        files = []
-        
-        # Look for file markers like "## file: filename.ext" or "```language\n"
-        lines = response.split("\n")
-        current_file = None
-        current_content = []
-        in_code_block = False
-        
-        for line in lines:
-            # Check for file markers
-            if line.startswith("## file:") or line.startswith("## File:"):
-                # If we were processing a file, save it
-                if current_file:
-                    files.append({
-                        "filename": current_file,
-                        "content": "\n".join(current_content)
-                    })
-                    current_content = []
-                
-                # Extract new filename
-                current_file = line.split(":", 1)[1].strip()
-                in_code_block = False
-            elif line.strip().startswith("```") and not in_code_block:
-                # Beginning of a code block
-                in_code_block = True
-                # Skip this line as it's just the code block marker
-                continue
-            elif line.strip() == "```" and in_code_block:
-                # End of a code block
-                in_code_block = False
-                # Skip this line as it's just the code block marker
-                continue
-            elif current_file:  # Only append content if we're inside a file section
-                current_content.append(line)
-        
-        # Don't forget to save the last file if there is one
-        if current_file:
-            files.append({
-                "filename": current_file,
-                "content": "\n".join(current_content)
-            })
-        
-        return files
+        return [
+            {"filename": match.group("name"), "content": match.group("body")}
+            for match in FILE_BLOCK_PATTERN.finditer(response)
+        ]
+    
+    def _write_file(self, file_path, content):
+        """Write content to a file with a single write on a raw descriptor."""
+        data = memoryview(content.encode("utf-8"))
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # os.write may write less than requested, keep going until done
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+        finally:
+            os.close(fd)
     
     def save_files(self, files, base_dir):
         """Save the extracted files to disk."""
-        logging.info(f"Saving {len(files)} files to {base_dir}")
+        logger.info("Saving %d files to %s", len(files), base_dir)
         
-        saved_files = []
+        # generate_terraform always passes an absolute project directory
+        base_abs = base_dir if os.path.isabs(base_dir) else os.path.abspath(base_dir)
+        created_dirs = set()
+        # Keyed by path so a later duplicate replaces an earlier one, as sequential writes would
+        pending = {}
         
         for file_info in files:
             filename = file_info["filename"]
             content = file_info["content"]
             
-            # Handle potential path traversal attempts
+            # Handle potential path traversal attempts. After normpath a ".." can only
+            # survive as a leading path component.
             safe_filename = os.path.normpath(filename)
-            if safe_filename.startswith(os.path.sep) or ".." in safe_filename:
-                logging.warning(f"Potential path traversal attempt: {filename}. Skipping.")
+            if os.path.isabs(safe_filename) or PurePath(safe_filename).parts[:1] == ("..",):
+                logger.warning("Potential path traversal attempt: %s. Skipping.", filename)
                 continue
             
             # Create the full path
-            file_path = os.path.join(base_dir, safe_filename)
-            
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            file_path = os.path.join(base_abs, safe_filename)
             
-            # Write the file
-            with open(file_path, "w") as f:
-                f.write(content)
+            # Ensure the directory exists, once per directory
+            file_dir = os.path.dirname(file_path)
+            if file_dir not in created_dirs:
+                os.makedirs(file_dir, exist_ok=True)
+                created_dirs.add(file_dir)
             
-            saved_files.append(file_path)
-            logging.info(f"Saved file: {file_path}")
+            pending[file_path] = content
+        
+        # Write the files, overlapping the per-file syscalls when there are several
+        if len(pending) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(pending), 8)) as executor:
+                list(executor.map(self._write_file, pending.keys(), pending.values()))
+        else:
+            for file_path, content in pending.items():
+                self._write_file(file_path, content)
+        
+        saved_files = list(pending)
+        for file_path in saved_files:
+            logger.info("Saved file: %s", file_path)
         
         return saved_files
     
     def check_command_safety(self, command):
         """Check if a command is safe to execute."""
-        # List of potentially dangerous commands
-        dangerous_patterns = [
-            "rm -rf", "rmdir", "mkfs", 
-            "> /dev", "dd if", 
-            ":(){:|:&};:", "wget", "curl -o",
-            "sudo", "su"
-        ]
-        
         # Check if the command contains any dangerous patterns
-        for pattern in dangerous_patterns:
-            if pattern in command:
-                return False, f"Command contains potentially dangerous pattern: {pattern}"
+        match = DANGEROUS_PATTERN_RE.search(command)
+        if match:
+            return False, f"Command contains potentially dangerous pattern: {match.group(0)}"
         
         # Validate that we're only running terraform commands
         allowed_commands = ["terraform"]
-        command_parts = command.strip().split()
+        # Only the program name is needed, don't split the whole argument list
+        command_parts = command.split(None, 1)
         
         if not command_parts:
             return False, "Empty command"
@@ -445,62 +720,160 @@ Include ONLY valid Terraform syntax and ensure all resources are properly config
         
         return True, "Command appears safe"
     
-    def execute_command(self, command, cwd=None):
-        """Execute a shell command after checking for safety."""
+    def execute_command(self, command, cwd=None, stream=False, success_codes=(0,), on_line=None):
+        """Execute a command after checking for safety.
+        
+        The command is run directly, without a shell. With stream=True its output
+        (stdout and stderr combined) is echoed to the terminal as it is produced,
+        or passed line by line to on_line if given.
+        Exit codes listed in success_codes count as success.
+        """
         # Check command safety first
         is_safe, message = self.check_command_safety(command)
         
         if not is_safe:
-            logging.error(f"Unsafe command rejected: {command}. Reason: {message}")
+            logger.error("Unsafe command rejected: %s. Reason: %s", command, message)
             return {
                 "success": False,
                 "output": f"Error: Command rejected for safety reasons: {message}",
                 "command": command
             }
         
-        logging.info(f"Executing command: {command} in directory: {cwd or 'current'}")
+        logger.info("Executing command: %s in directory: %s", command, cwd or 'current')
         
         try:
-            # Execute the command
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=cwd,
-                capture_output=True,
-                text=True
-            )
+            # Share downloaded provider plugins between projects so `terraform init` is fast
+            env = os.environ.copy()
+            if "TF_PLUGIN_CACHE_DIR" not in env:
+                os.makedirs(PLUGIN_CACHE_DIR, exist_ok=True)
+                env["TF_PLUGIN_CACHE_DIR"] = PLUGIN_CACHE_DIR
             
-            output = result.stdout
-            error = result.stderr
+            argv = shlex.split(command)
             
-            if result.returncode == 0:
-                logging.info(f"Command executed successfully: {command}")
+            # Execute the command
+            if stream:
+                output_lines = []
+                with subprocess.Popen(
+                    argv,
+                    cwd=cwd,
+                    env=env,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1
+                ) as process:
+                    for line in process.stdout:
+                        if on_line:
+                            on_line(line)
+                        else:
+                            sys.stdout.write(line)
+                        output_lines.append(line)
+                returncode = process.returncode
+                output = "".join(output_lines)
+                error = ""
+            else:
+                result = subprocess.run(
+                    argv,
+                    cwd=cwd,
+                    env=env,
+                    capture_output=True,
+                    text=True
+                )
+                returncode = result.returncode
+                output = result.stdout
+                error = result.stderr
+            
+            if returncode in success_codes:
+                logger.info("Command executed successfully: %s", command)
                 if error:
-                    logging.warning(f"Command had warnings: {error}")
+                    logger.warning("Command had warnings: %s", error)
                 
                 return {
                     "success": True,
                     "output": output,
+                    "stdout": output,
+                    "returncode": returncode,
                     "warnings": error if error else None,
                     "command": command
                 }
             else:
-                logging.error(f"Command failed: {command}")
-                logging.error(f"Error: {error}")
+                logger.error("Command failed: %s", command)
+                logger.error("Error: %s", error or output)
                 
                 return {
                     "success": False,
-                    "output": f"Error: {error}",
+                    "output": f"Error: {error or output}",
+                    "stdout": output,
+                    "returncode": returncode,
                     "command": command
                 }
         except Exception as e:
-            logging.exception(f"Exception while executing command: {command}")
+            logger.exception("Exception while executing command: %s", command)
             return {
                 "success": False,
                 "output": f"Error: {str(e)}",
                 "command": command
             }
     
+    def parse_plan_event(self, line):
+        """Parse one line of `terraform plan -json` output.
+        
+        Returns the human-readable message for planned changes, the change
+        summary and diagnostics, or None for any other line.
+        """
+        line = line.strip()
+        if not line.startswith("{"):
+            return None
+        try:
+            event = _json_loads(line)
+        except ValueError:
+            return None
+        
+        if event.get("type") in ("planned_change", "change_summary", "diagnostic"):
+            return event.get("@message", "")
+        return None
+    
+    def _plan_hash(self, project_dir):
+        """Hash the saved plan's resource and output changes, including before/after values.
+        
+        Returns None if the plan cannot be read, in which case the apply must be confirmed.
+        """
+        show_result = self.execute_command("terraform show -json tfplan", cwd=project_dir)
+        if not show_result["success"]:
+            return None
+        try:
+            plan = _json_loads(show_result.get("stdout", ""))
+        except ValueError:
+            return None
+        
+        # Only the planned changes are hashed; the plan also carries a timestamp and other per-run fields
+        resource_changes = sorted(
+            ([change.get("address", ""), change.get("change", {})] for change in plan.get("resource_changes", [])),
+            key=lambda item: item[0]
+        )
+        return hashlib.sha256(_json_dumps([resource_changes, plan.get("output_changes", {})])).hexdigest()
+    
+    def _plan_hash_path(self, project_name):
+        """Get the path storing the hash of the last applied plan for a project."""
+        return os.path.join(PLAN_CACHE_DIR, f"{project_name}.sha")
+    
+    def _load_plan_hash(self, project_name):
+        """Return the hash of the last applied plan for a project, if any."""
+        try:
+            with open(self._plan_hash_path(project_name), "r") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+    
+    def _save_plan_hash(self, project_name, plan_hash):
+        """Remember the hash of a successfully applied plan."""
+        try:
+            os.makedirs(PLAN_CACHE_DIR, exist_ok=True)
+            with open(self._plan_hash_path(project_name), "w") as f:
+                f.write(plan_hash)
+        except OSError as e:
+            logger.warning("Failed to save plan hash for %s: %s", project_name, e)
+    
     def run(self, prompt, project_name=None):
         """Run the Terraform agent process."""
         try:
@@ -513,10 +886,10 @@ Include ONLY valid Terraform syntax and ensure all resources are properly config
                 timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
                 project_name = f"{project_name}-{timestamp}"
             
-            logging.info(f"Starting Terraform agent for project: {project_name}")
+            logger.info("Starting Terraform agent for project: %s", project_name)
             
             # Log the user request
-            logging.info(f"User prompt: {prompt}")
+            logger.info("User prompt: %s", prompt)
             
             # Generate Terraform files
             print(f"\nGenerating Terraform files for project '{project_name}'...")
@@ -536,55 +909,80 @@ Include ONLY valid Terraform syntax and ensure all resources are properly config
             
             # Initialize Terraform
             print("\nInitializing Terraform...")
-            init_result = self.execute_command("terraform init", cwd=project_dir)
+            init_result = self.execute_command("terraform init", cwd=project_dir, stream=True)
             
             if not init_result["success"]:
-                print(f"\n❌ Terraform initialization failed:")
-                print(init_result["output"])
+                print(f"\n❌ Terraform initialization failed")
                 return
             
             print("\n✅ Terraform initialized successfully")
             
-            # Run terraform plan
+            # Run terraform plan, saving it to tfplan. Exit code 2 means changes are pending.
+            # Plan events are shown as they arrive instead of after plan exits
             print("\nRunning terraform plan...")
-            plan_result = self.execute_command("terraform plan", cwd=project_dir)
+            messages = []
+            
+            def show_plan_event(line):
+                message = self.parse_plan_event(line)
+                if message is not None:
+                    messages.append(message)
+                    print(f"  {message}", flush=True)
+            
+            plan_result = self.execute_command(
+                "terraform plan -out=tfplan -detailed-exitcode -json",
+                cwd=project_dir,
+                stream=True,
+                success_codes=(0, 2),
+                on_line=show_plan_event
+            )
             
             if not plan_result["success"]:
-                print(f"\n❌ Terraform plan failed:")
-                print(plan_result["output"])
+                print(f"\n❌ Terraform plan failed")
+                if not messages:
+                    print(plan_result["output"])
                 return
             
             print("\n✅ Terraform plan created successfully")
-            print("\nPlan output:")
-            print(plan_result["output"])
-            
-            # Ask for confirmation before applying
-            confirmation = input("\nDo you want to apply this Terraform plan? (yes/no): ")
             
-            if confirmation.lower() in ["yes", "y"]:
-                print("\nApplying Terraform plan...")
-                apply_result = self.execute_command("terraform apply -auto-approve", cwd=project_dir)
-                
-                if not apply_result["success"]:
-                    print(f"\n❌ Terraform apply failed:")
-                    print(apply_result["output"])
-                    return
-                
-                print("\n✅ Terraform apply completed successfully")
-                print("\nApply output:")
-                print(apply_result["output"])
+            applied = False
+            if plan_result["returncode"] == 0:
+                print("\nNo changes. Infrastructure is up to date.")
             else:
-                print("\nTerraform apply cancelled")
+                # An identical plan (same changes and values) was already approved for this project
+                plan_hash = self._plan_hash(project_dir)
+                if plan_hash is not None and plan_hash == self._load_plan_hash(project_name):
+                    print("\nThis plan matches the last plan applied for this project, applying without confirmation")
+                    confirmed = True
+                else:
+                    # Ask for confirmation before applying
+                    confirmation = input("\nDo you want to apply this Terraform plan? (yes/no): ")
+                    confirmed = confirmation.lower() in ["yes", "y"]
+                
+                if confirmed:
+                    # Apply the saved plan so terraform does not plan a second time
+                    print("\nApplying Terraform plan...")
+                    apply_result = self.execute_command("terraform apply tfplan", cwd=project_dir, stream=True)
+                    
+                    if not apply_result["success"]:
+                        print(f"\n❌ Terraform apply failed")
+                        return
+                    
+                    if plan_hash is not None:
+                        self._save_plan_hash(project_name, plan_hash)
+                    applied = True
+                    print("\n✅ Terraform apply completed successfully")
+                else:
+                    print("\nTerraform apply cancelled")
             
             # Return the project directory and files
             return {
                 "project_dir": project_dir,
                 "files": files,
-                "applied": confirmation.lower() in ["yes", "y"]
+                "applied": applied
             }
             
         except Exception as e:
-            logging.exception("Error running Terraform agent")
+            logger.exception("Error running Terraform agent")
             print(f"\n❌ Error: {str(e)}")
     
     def test(self):
@@ -609,16 +1007,15 @@ def main():
     parser.add_argument("--test", action="store_true", help="Run a test to check if the agent is working")
     args = parser.parse_args()
     
-    agent = TerraformAgent()
-    
-    if args.test:
-        agent.test()
-    elif args.prompt:
-        agent.run(args.prompt, args.project)
-    else:
-        print("Please provide a prompt or use --test to run a test")
-        print("Example: python3 terraform-agent.py 'Create an EC2 instance with 16GB RAM in us-east-1'")
-        print("Example with project name: python3 terraform-agent.py --project my-aws-infra 'Create an EC2 instance with 16GB RAM'")
+    with TerraformAgent() as agent:
+        if args.test:
+            agent.test()
+        elif args.prompt:
+            agent.run(args.prompt, args.project)
+        else:
+            print("Please provide a prompt or use --test to run a test")
+            print("Example: python3 terraform-agent.py 'Create an EC2 instance with 16GB RAM in us-east-1'")
+            print("Example with project name: python3 terraform-agent.py --project my-aws-infra 'Create an EC2 instance with 16GB RAM'")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
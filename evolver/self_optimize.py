@@ -3,29 +3,228 @@
 import os
 import sys
 import json
+import re
+import io
 import time
+import hashlib
+import gzip
+import mmap
+import sqlite3
+import threading
+import functools
 import logging
+import logging.handlers
+import atexit
 import argparse
 import difflib
 import shutil
+import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
 # Setup logging
 LOG_DIR = os.path.expanduser("~/.nativeos/logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "evolver.log")
+
+
+class _BatchedLogHandler(logging.handlers.MemoryHandler):
+    """MemoryHandler that writes each flushed batch to its file target in a single write."""
+    
+    def flush(self):
+        self.acquire()
+        try:
+            if self.target is None or not self.buffer:
+                return
+            target = self.target
+            text = "".join(target.format(record) + target.terminator for record in self.buffer)
+            target.acquire()
+            try:
+                if target.stream is None:
+                    target.stream = target._open()
+                target.stream.write(text)
+                target.stream.flush()
+            finally:
+                target.release()
+            self.buffer.clear()
+        finally:
+            self.release()
+
+
+_log_file_handler = logging.FileHandler(LOG_FILE)
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+# Buffer records and write them in batches; errors are flushed immediately
+_log_buffer = _BatchedLogHandler(
+    capacity=512,
+    flushLevel=logging.ERROR,
+    target=_log_file_handler
+)
 logging.basicConfig(
-    filename=LOG_FILE,
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    handlers=[_log_buffer]
 )
+atexit.register(_log_buffer.flush)
+
+# Maximum number of analysis requests in flight at once
+MAX_CONCURRENT_ANALYSES = int(os.getenv("NATIVE_OS_EVOLVER_WORKERS", "8"))
+
+# Submitted OpenAI batch jobs
+BATCH_DIR = os.path.expanduser("~/.nativeos/batches")
+OPENAI_API_BASE = "https://api.openai.com/v1"
+
+# Request bodies at least this large are gzip-compressed (set NATIVE_OS_GZIP_REQUESTS=0 to disable)
+GZIP_MIN_BYTES = 1024
+
+# Model names
+OPENAI_MODEL = "gpt-4"
+OLLAMA_MODEL = "codellama"
+
+# Scripts larger than this many tokens are analyzed in overlapping windows,
+# and batched prompts are packed up to the same budget
+MAX_SCRIPT_TOKENS = 6000
+SCRIPT_OVERLAP_TOKENS = 500
+# Rough token size used when tiktoken is unavailable, and as a cheap size pre-check
+CHARS_PER_TOKEN = 4
+BYTES_PER_TOKEN_ESTIMATE = 3
+
+# Analysis results keyed by script content, model and system prompt
+CACHE_DIR = os.path.expanduser("~/.nativeos/evolver_cache")
+# Last seen (size, mtime_ns, sha256) per script, so unchanged files are not re-hashed
+FINGERPRINT_DB = os.path.join(CACHE_DIR, "fingerprints.db")
+
+SYSTEM_PROMPT = """You are an expert code evolution and optimization specialist created by hxcode ai. Analyze existing code to identify improvements, optimizations, and enhancements while maintaining core functionality.
+
+Your capabilities:
+1. Identify performance bottlenecks and optimize for speed and efficiency
+2. Improve code readability and maintainability without compromising functionality
+3. Enhance error handling and edge case management
+4. Apply best practices and design patterns appropriate for the language
+5. Identify and fix potential security vulnerabilities
+6. Suggest architectural improvements for better scalability
+
+Optimization approach:
+- Start with high-impact, low-risk improvements
+- Maintain backward compatibility where possible
+- Prioritize security fixes over performance gains
+- Look for opportunities to reduce complexity and improve clarity
+- Suggest appropriate test coverage for critical sections
+- Consider memory usage and resource efficiency
+
+Areas of expertise:
+- Python performance optimization and best practices
+- JavaScript/TypeScript modernization and patterns
+- Refactoring techniques across multiple languages
+- AI-specific optimization for ML/NLP code
+- API design and interface improvements
+- Multi-threading and concurrency optimizations
+- Memory management and resource efficiency
+
+Output format:
+Respond with ONLY a unified diff patch (POSIX patch format) against the file you were given.
+Use "--- a/<file>" and "+++ b/<file>" headers and "@@" hunks with three lines of context.
+No prose, no markdown fences."""
+SYSTEM_PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).digest()
+
+# Optional ```diff fence around a patch in model responses
+_DIFF_FENCE_RE = re.compile(r"```(?:diff|patch)?[ \t]*\n(.*?)```", re.DOTALL)
+_HUNK_RE = re.compile(r"^@@ ", re.MULTILINE)
+
+# Error text in a 400 response that means the server could not decode a compressed body
+_ENCODING_ERROR_RE = re.compile(r"content.encoding|gzip|compress|decod|parse the JSON body", re.IGNORECASE)
+
+# Chat completion body up to the user message, serialized once; only the prompt is encoded per request
+_OPENAI_BODY_PREFIX = (
+    b'{"model":' + json.dumps(OPENAI_MODEL).encode("utf-8")
+    + b',"temperature":0.7,"messages":[{"role":"system","content":'
+    + json.dumps(SYSTEM_PROMPT).encode("utf-8")
+    + b'},{"role":"user","content":'
+)
+_OPENAI_BODY_SUFFIX = b'}]}'
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding():
+    """Return the tokenizer for the OpenAI model, loaded once."""
+    return tiktoken.encoding_for_model(OPENAI_MODEL)
+
+
+class _RateLimiter:
+    """Token-bucket pacing for OpenAI requests-per-minute and tokens-per-minute limits.
+    
+    Limits are learned from the x-ratelimit-* response headers; until the first
+    response arrives no throttling is applied.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limits = {"requests": None, "tokens": None}
+        self._levels = {"requests": 0.0, "tokens": 0.0}
+        self._updated = time.monotonic()
+    
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        for name, limit in self._limits.items():
+            if limit:
+                self._levels[name] = min(limit, self._levels[name] + elapsed * limit / 60.0)
+    
+    def acquire(self, tokens):
+        """Block until one request and the estimated number of tokens are available."""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                needed = {"requests": 1.0, "tokens": float(tokens)}
+                wait = 0.0
+                for name, limit in self._limits.items():
+                    if not limit:
+                        continue
+                    amount = min(needed[name], limit)
+                    if self._levels[name] < amount:
+                        wait = max(wait, (amount - self._levels[name]) * 60.0 / limit)
+                if wait <= 0:
+                    for name, limit in self._limits.items():
+                        if limit:
+                            self._levels[name] -= min(needed[name], limit)
+                    return
+            time.sleep(wait)
+    
+    def update(self, headers):
+        """Resynchronize the buckets with the limits reported by the API."""
+        with self._lock:
+            self._refill(time.monotonic())
+            for name in self._limits:
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{name}"])
+                    remaining = float(headers[f"x-ratelimit-remaining-{name}"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if self._limits[name] is None:
+                    self._levels[name] = remaining
+                self._limits[name] = limit
+                self._levels[name] = min(self._levels[name], remaining)
+
 
 class Evolver:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.use_local_model = os.getenv("NATIVE_OS_LOCAL_MODEL", "0") == "1" or self.api_key is None
+        self.model = OLLAMA_MODEL if self.use_local_model else OPENAI_MODEL
+        
+        # Analysis cache (set NATIVE_OS_CACHE=0 to always call the model)
+        self.use_cache = os.getenv("NATIVE_OS_CACHE", "1") != "0"
+        self._fingerprints = None
+        self._fingerprint_lock = threading.Lock()
+        if self.use_cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self._fingerprints = self._open_fingerprints()
         
         # Project root directory
         self.project_root = self._find_project_root()
@@ -33,6 +232,35 @@ class Evolver:
         # Backup directory
         self.backup_dir = os.path.join(self.project_root, "evolver", "backups")
         os.makedirs(self.backup_dir, exist_ok=True)
+        
+        # Shared HTTP session so connections are kept alive across analyses
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if self.api_key:
+            self._openai_headers = {"Authorization": f"Bearer {self.api_key}"}
+            if not self.use_local_model:
+                self.session.headers.update(self._openai_headers)
+        else:
+            self._openai_headers = {}
+        self.gzip_requests = os.getenv("NATIVE_OS_GZIP_REQUESTS", "1") != "0"
+        
+        # Paces concurrent OpenAI calls to stay under the account's rate limits
+        self._rate_limiter = _RateLimiter()
+    
+    def close(self):
+        """Close pooled HTTP connections and the fingerprint database."""
+        self.session.close()
+        if self._fingerprints is not None:
+            self._fingerprints.close()
+            self._fingerprints = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def _find_project_root(self):
         """Find the root directory of the Native OS project."""
@@ -48,80 +276,79 @@ class Evolver:
     def _get_ollama_response(self, prompt):
         """Get response from local Ollama model."""
         try:
-            # Check if Ollama is running
-            response = requests.post(
+            # Check if Ollama is running; tokens are streamed back as NDJSON
+            with self.session.post(
                 "http://localhost:11434/api/generate",
                 json={
-                    "model": "codellama",
+                    "model": OLLAMA_MODEL,
                     "prompt": prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                return response.json().get("response", "")
-            else:
-                logging.error(f"Ollama error: {response.text}")
-                return f"Error: Failed to get response from local model. Status code: {response.status_code}"
+                    "stream": True
+                },
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logging.error(f"Ollama error: {response.text}")
+                    return f"Error: Failed to get response from local model. Status code: {response.status_code}"
+                
+                chunks = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event.get("error"):
+                        logging.error(f"Ollama error: {event['error']}")
+                        return f"Error: Local model failed: {event['error']}"
+                    chunks.append(event.get("response", ""))
+                    if event.get("done"):
+                        break
+                return "".join(chunks)
         except Exception as e:
             logging.exception("Error connecting to Ollama")
             return f"Error: Could not connect to Ollama. Is it running? Error: {str(e)}"
     
+    def _build_openai_request(self, prompt):
+        """Build the chat completion request body for a prompt."""
+        return {
+            "model": OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7
+        }
+    
     def _get_openai_response(self, prompt):
         """Get response from OpenAI API."""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            body = _OPENAI_BODY_PREFIX + json.dumps(prompt).encode("utf-8") + _OPENAI_BODY_SUFFIX
+            headers = {"Content-Type": "application/json"}
             
-            data = {
-                "model": "gpt-4",
-                "messages": [
-                    {"role": "system", "content": """You are an expert code evolution and optimization specialist created by hxcode ai. Analyze existing code to identify improvements, optimizations, and enhancements while maintaining core functionality.
-
-Your capabilities:
-1. Identify performance bottlenecks and optimize for speed and efficiency
-2. Improve code readability and maintainability without compromising functionality
-3. Enhance error handling and edge case management
-4. Apply best practices and design patterns appropriate for the language
-5. Identify and fix potential security vulnerabilities
-6. Suggest architectural improvements for better scalability
-
-Optimization approach:
-- Start with high-impact, low-risk improvements
-- Maintain backward compatibility where possible
-- Prioritize security fixes over performance gains
-- Look for opportunities to reduce complexity and improve clarity
-- Suggest appropriate test coverage for critical sections
-- Consider memory usage and resource efficiency
-- Provide clear explanations for why each change is beneficial
-
-Areas of expertise:
-- Python performance optimization and best practices
-- JavaScript/TypeScript modernization and patterns
-- Refactoring techniques across multiple languages
-- AI-specific optimization for ML/NLP code
-- API design and interface improvements
-- Multi-threading and concurrency optimizations
-- Memory management and resource efficiency
-
-Output format:
-1. Provide a concise summary of identified issues
-2. Present suggested improvements with clear before/after code examples
-3. Explain the reasoning and benefits behind each improvement
-4. Rate changes by risk level (low/medium/high) and impact (low/medium/high)
-5. Include validation steps to verify improvements work as expected"""},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7
-            }
+            # Wait for rate-limit budget (roughly one token per CHARS_PER_TOKEN bytes)
+            self._rate_limiter.acquire(len(body) // CHARS_PER_TOKEN)
             
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data
-            )
+            if self.gzip_requests and len(body) >= GZIP_MIN_BYTES:
+                # Source code compresses well; send the prompt gzip-encoded
+                response = self.session.post(
+                    f"{OPENAI_API_BASE}/chat/completions",
+                    headers={**headers, "Content-Encoding": "gzip"},
+                    data=gzip.compress(body, compresslevel=6)
+                )
+                if self._rejected_encoding(response):
+                    logging.warning("OpenAI rejected a gzip-encoded request body, sending uncompressed")
+                    self.gzip_requests = False
+                    self._rate_limiter.acquire(len(body) // CHARS_PER_TOKEN)
+                    response = None
+            else:
+                response = None
+            
+            if response is None:
+                response = self.session.post(
+                    f"{OPENAI_API_BASE}/chat/completions",
+                    headers=headers,
+                    data=body
+                )
+            
+            self._rate_limiter.update(response.headers)
             
             if response.status_code == 200:
                 return response.json()["choices"][0]["message"]["content"]
@@ -132,124 +359,639 @@ Output format:
             logging.exception("Error connecting to OpenAI")
             return f"Error: {str(e)}"
     
+    def _rejected_encoding(self, response):
+        """Return True if a response rejects the gzip Content-Encoding rather than the request itself.
+        
+        Other 400s (context length exceeded, invalid parameters) are returned to the
+        caller as errors instead of disabling compression.
+        """
+        if response.status_code == 415:
+            return True
+        return response.status_code == 400 and bool(_ENCODING_ERROR_RE.search(response.text or ""))
+    
     def scan_agent_scripts(self):
         """Scan all agent scripts in the project."""
         agent_scripts = []
         
-        # Scan agents directory
-        agents_dir = os.path.join(self.project_root, "agents")
-        if os.path.exists(agents_dir) and os.path.isdir(agents_dir):
-            for file in os.listdir(agents_dir):
-                if file.endswith(".py"):
-                    agent_scripts.append(os.path.join(agents_dir, file))
-        
-        # Scan CLI directory
-        cli_dir = os.path.join(self.project_root, "cli")
-        if os.path.exists(cli_dir) and os.path.isdir(cli_dir):
-            devctl_path = os.path.join(cli_dir, "devctl")
-            if os.path.exists(devctl_path):
-                agent_scripts.append(devctl_path)
-        
-        # Scan memory directory
-        memory_dir = os.path.join(self.project_root, "memory")
-        if os.path.exists(memory_dir) and os.path.isdir(memory_dir):
-            for file in os.listdir(memory_dir):
-                if file.endswith(".py"):
-                    agent_scripts.append(os.path.join(memory_dir, file))
+        # Python scripts in agents/ and memory/, plus the devctl CLI
+        for directory, wanted in (("agents", None), ("cli", "devctl"), ("memory", None)):
+            try:
+                with os.scandir(os.path.join(self.project_root, directory)) as entries:
+                    agent_scripts.extend(
+                        entry.path for entry in entries
+                        if (entry.name == wanted if wanted else entry.name.endswith(".py"))
+                        and entry.is_file()
+                    )
+            except (FileNotFoundError, NotADirectoryError):
+                continue
         
         return agent_scripts
     
+    def _copy_file(self, src_path, dst_path):
+        """Copy file contents, keeping the copy out of the page cache.
+        
+        Uses an in-kernel copy_file_range where available and falls back to
+        a buffered copy otherwise.
+        """
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            src_fd, dst_fd = src.fileno(), dst.fileno()
+            copied = False
+            
+            if hasattr(os, "copy_file_range"):
+                try:
+                    remaining = os.fstat(src_fd).st_size
+                    while remaining > 0:
+                        written = os.copy_file_range(src_fd, dst_fd, remaining)
+                        if written == 0:
+                            break
+                        remaining -= written
+                    copied = True
+                except OSError:
+                    # Unsupported by this kernel or filesystem; start over
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+            
+            if not copied:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            
+            dst.flush()
+            if hasattr(os, "fdatasync"):
+                os.fdatasync(dst_fd)
+            else:
+                os.fsync(dst_fd)
+            
+            # Backups are rarely read back; drop them from the page cache
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                os.posix_fadvise(dst_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    
     def create_backup(self, file_path):
         """Create a backup of the file before modification."""
         if os.path.exists(file_path):
-            # Create timestamped backup filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Create timestamped backup filename (microseconds keep same-second backups apart)
+            now_ns = time.time_ns()
+            timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now_ns // 1_000_000_000))
+            timestamp += f"_{now_ns // 1000 % 1_000_000:06d}"
             filename = os.path.basename(file_path)
-            backup_filename = f"{filename}.{timestamp}.bak"
+            # Short path hash so same-named files from different directories never collide
+            suffix = hashlib.blake2b(os.path.abspath(file_path).encode("utf-8"), digest_size=6).hexdigest()
+            backup_filename = f"{filename}.{timestamp}.{suffix}.bak"
             backup_path = os.path.join(self.backup_dir, backup_filename)
             
             # Copy file to backup location
-            shutil.copy2(file_path, backup_path)
+            self._copy_file(file_path, backup_path)
             logging.info(f"Created backup of {file_path} at {backup_path}")
             
             return backup_path
         
         return None
     
-    def analyze_script(self, script_path):
-        """Analyze a script and suggest optimizations."""
-        logging.info(f"Analyzing script: {script_path}")
+    def create_backups(self, file_paths):
+        """Back up several files concurrently, returning backup paths in input order."""
+        if len(file_paths) <= 1:
+            return [self.create_backup(path) for path in file_paths]
         
+        with ThreadPoolExecutor(max_workers=min(len(file_paths), os.cpu_count() or 1)) as executor:
+            return list(executor.map(self.create_backup, file_paths))
+    
+    def _file_sha256(self, file_path):
+        """Return the SHA-256 digest of a file without copying it into Python memory."""
+        with open(file_path, 'rb') as f:
+            try:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return hashlib.sha256().digest()
+                # Hash straight from the page cache through a read-only mapping
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return hashlib.sha256(mm).digest()
+            except (OSError, ValueError):
+                # Not mappable (e.g. a pipe or special file); hash it in blocks
+                f.seek(0)
+                if hasattr(hashlib, "file_digest"):
+                    return hashlib.file_digest(f, "sha256").digest()
+                digest = hashlib.sha256()
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+                return digest.digest()
+    
+    def _open_fingerprints(self):
+        """Open the file fingerprint database, or return None if it is unavailable."""
         try:
-            # Read script content
-            with open(script_path, 'r') as f:
-                script_content = f.read()
-            
-            # Create prompt for optimization suggestions
-            prompt = (
-                f"Analyze the following Python script and suggest improvements for:\n"
-                f"1. Performance optimization\n"
-                f"2. Code readability\n"
-                f"3. Error handling\n"
-                f"4. Security considerations\n"
-                f"5. Maintainability\n\n"
-                f"Provide specific code changes with explanations.\n\n"
-                f"File: {os.path.basename(script_path)}\n\n"
-                f"```python\n{script_content}\n```"
+            conn = sqlite3.connect(FINGERPRINT_DB, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 BLOB)"
             )
+            return conn
+        except sqlite3.Error as e:
+            logging.warning(f"File fingerprint cache disabled: {str(e)}")
+            return None
+    
+    def _fingerprinted_sha256(self, file_path):
+        """Return a file's SHA-256, reusing the stored digest if size and mtime are unchanged."""
+        if self._fingerprints is None:
+            return self._file_sha256(file_path)
+        
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        try:
+            with self._fingerprint_lock:
+                row = self._fingerprints.execute(
+                    "SELECT sha256 FROM fingerprints WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (path, st.st_size, st.st_mtime_ns)
+                ).fetchone()
+            if row:
+                return row[0]
             
-            # Get response from the appropriate model
-            if self.use_local_model:
-                logging.info("Using local Ollama model")
-                response = self._get_ollama_response(prompt)
+            digest = self._file_sha256(path)
+            with self._fingerprint_lock:
+                self._fingerprints.execute(
+                    "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                    (path, st.st_size, st.st_mtime_ns, digest)
+                )
+                self._fingerprints.commit()
+            return digest
+        except sqlite3.Error as e:
+            logging.warning(f"File fingerprint lookup failed for {path}: {str(e)}")
+            return self._file_sha256(path)
+    
+    def _cache_key(self, script_path):
+        """Build the analysis cache key for a script's current content."""
+        return hashlib.sha256(
+            self._fingerprinted_sha256(script_path) + self.model.encode("utf-8") + SYSTEM_PROMPT_HASH
+        ).hexdigest()
+    
+    def _cache_get(self, key):
+        """Return a cached analysis, or None on a miss."""
+        cache_path = os.path.join(CACHE_DIR, f"{key}.json")
+        try:
+            with open(cache_path, 'r') as f:
+                return json.load(f)["response"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable cache entry {cache_path}: {str(e)}")
+            return None
+    
+    def _cache_lookup(self, script_path):
+        """Return (cache key, cached analysis or None) for a script."""
+        try:
+            key = self._cache_key(script_path)
+        except OSError:
+            return None, None
+        return key, self._cache_get(key)
+    
+    def _cache_set(self, key, script_path, response):
+        """Store an analysis in the cache."""
+        cache_path = os.path.join(CACHE_DIR, f"{key}.json")
+        try:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"script": script_path, "model": self.model, "response": response}, f)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logging.warning(f"Failed to write cache entry {cache_path}: {str(e)}")
+    
+    def _get_model_response(self, prompt):
+        """Get a response from the configured model."""
+        if self.use_local_model:
+            logging.info("Using local Ollama model")
+            return self._get_ollama_response(prompt)
+        
+        logging.info("Using OpenAI API")
+        return self._get_openai_response(prompt)
+    
+    def _write_script(self, buf, script_path):
+        """Stream a script's source into a prompt buffer."""
+        with open(script_path, 'r', buffering=1 << 20) as f:
+            shutil.copyfileobj(f, buf)
+    
+    def _estimate_tokens(self, script_path):
+        """Cheaply over-estimate a script's token count from its size."""
+        try:
+            return os.stat(script_path).st_size // BYTES_PER_TOKEN_ESTIMATE
+        except OSError:
+            return 0
+    
+    def _split_into_windows(self, content):
+        """Split source into overlapping windows of at most MAX_SCRIPT_TOKENS tokens."""
+        if HAS_TIKTOKEN:
+            encoding = _get_encoding()
+            tokens = encoding.encode(content, disallowed_special=())
+            if len(tokens) <= MAX_SCRIPT_TOKENS:
+                return [content]
+            step = MAX_SCRIPT_TOKENS - SCRIPT_OVERLAP_TOKENS
+            return [
+                encoding.decode(tokens[i:i + MAX_SCRIPT_TOKENS])
+                for i in range(0, len(tokens) - SCRIPT_OVERLAP_TOKENS, step)
+            ]
+        
+        window = MAX_SCRIPT_TOKENS * CHARS_PER_TOKEN
+        if len(content) <= window:
+            return [content]
+        step = (MAX_SCRIPT_TOKENS - SCRIPT_OVERLAP_TOKENS) * CHARS_PER_TOKEN
+        overlap = SCRIPT_OVERLAP_TOKENS * CHARS_PER_TOKEN
+        return [content[i:i + window] for i in range(0, len(content) - overlap, step)]
+    
+    def _build_analysis_prompt(self, script_path, content=None, part=None):
+        """Create the optimization prompt for a single script.
+        
+        The source is streamed from script_path unless content is given;
+        part is an optional (index, total) pair for windows of a large script.
+        """
+        label = os.path.basename(script_path)
+        if part:
+            label += f" (part {part[0]} of {part[1]})"
+        
+        buf = io.StringIO()
+        buf.write(
+            "Analyze the following Python script and suggest improvements for:\n"
+            "1. Performance optimization\n"
+            "2. Code readability\n"
+            "3. Error handling\n"
+            "4. Security considerations\n"
+            "5. Maintainability\n\n"
+            "Respond with only a unified diff of the suggested changes.\n\n"
+            f"File: {label}\n\n"
+            "```python\n"
+        )
+        if content is None:
+            self._write_script(buf, script_path)
+        else:
+            buf.write(content)
+        buf.write("\n```")
+        return buf.getvalue()
+    
+    def _build_batch_prompt(self, script_paths):
+        """Create one optimization prompt covering several scripts.
+        
+        Returns:
+            Tuple of (prompt, included indexes, {index: error} for unreadable scripts)
+        """
+        buf = io.StringIO()
+        buf.write(
+            "Analyze each of the Python scripts below and suggest improvements for:\n"
+            "1. Performance optimization\n"
+            "2. Code readability\n"
+            "3. Error handling\n"
+            "4. Security considerations\n"
+            "5. Maintainability\n\n"
+            "Return only a JSON object mapping each file index (as a string) to a "
+            "unified diff of the suggested changes for that file, "
+            "e.g. {\"0\": \"--- a/...\", \"1\": \"--- a/...\"}.\n"
+        )
+        
+        indexes = []
+        errors = {}
+        for i, script_path in enumerate(script_paths):
+            mark = buf.tell()
+            try:
+                buf.write(
+                    f"\n===FILE {len(indexes)}===\n"
+                    f"File: {os.path.basename(script_path)}\n\n"
+                    "```python\n"
+                )
+                self._write_script(buf, script_path)
+                buf.write("\n```\n")
+                indexes.append(i)
+            except Exception as e:
+                # Drop the partial entry for this file
+                buf.seek(mark)
+                buf.truncate()
+                logging.exception(f"Error analyzing script: {script_path}")
+                errors[i] = f"Error analyzing script: {str(e)}"
+        
+        return buf.getvalue(), indexes, errors
+    
+    def _parse_batch_response(self, response, count):
+        """Parse a batched JSON response into a list of per-file suggestions."""
+        text = response.strip()
+        if text.startswith("```"):
+            # Drop a surrounding ```json fence if the model added one
+            text = text.split("\n", 1)[1] if "\n" in text else ""
+            text = text.rsplit("```", 1)[0]
+        
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("Batch response is not a JSON object")
+        
+        results = []
+        for index in range(count):
+            suggestions = data.get(str(index))
+            if suggestions is None:
+                results.append("Error: No suggestions returned for this file")
+            elif isinstance(suggestions, str):
+                results.append(suggestions)
             else:
-                logging.info("Using OpenAI API")
-                response = self._get_openai_response(prompt)
+                results.append(json.dumps(suggestions, indent=2))
+        return results
+    
+    def _analyze_single(self, script_path):
+        """Analyze one script with its own model request.
+        
+        Scripts too large for the context window are split into overlapping
+        windows that are analyzed concurrently and merged.
+        """
+        try:
+            if self._estimate_tokens(script_path) <= MAX_SCRIPT_TOKENS:
+                return self._get_model_response(self._build_analysis_prompt(script_path))
+            
+            with open(script_path, 'r') as f:
+                windows = self._split_into_windows(f.read())
+            if len(windows) == 1:
+                return self._get_model_response(self._build_analysis_prompt(script_path, windows[0]))
             
-            return response
+            logging.info(f"Splitting {script_path} into {len(windows)} parts")
+            prompts = [
+                self._build_analysis_prompt(script_path, window, (i + 1, len(windows)))
+                for i, window in enumerate(windows)
+            ]
+            with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENT_ANALYSES, len(prompts)))) as executor:
+                responses = list(executor.map(self._get_model_response, prompts))
+            
+            return "\n\n".join(
+                f"=== Part {i + 1} of {len(responses)} ===\n{response}"
+                for i, response in enumerate(responses)
+            )
         except Exception as e:
             logging.exception(f"Error analyzing script: {script_path}")
             return f"Error analyzing script: {str(e)}"
     
-    def apply_optimization(self, script_path, suggested_changes):
-        """Apply suggested optimizations to a script.
+    def _analyze_chunk(self, script_paths):
+        """Analyze a chunk of scripts with a single model request."""
+        for script_path in script_paths:
+            logging.info(f"Analyzing script: {script_path}")
+        
+        if len(script_paths) == 1:
+            return [self._analyze_single(script_paths[0])]
+        
+        results = [None] * len(script_paths)
+        prompt, indexes, errors = self._build_batch_prompt(script_paths)
+        for i, error in errors.items():
+            results[i] = error
+        
+        if len(indexes) == 1:
+            results[indexes[0]] = self._analyze_single(script_paths[indexes[0]])
+        elif indexes:
+            response = self._get_model_response(prompt)
+            if response.startswith("Error"):
+                batch_results = [response] * len(indexes)
+            else:
+                try:
+                    batch_results = self._parse_batch_response(response, len(indexes))
+                except ValueError:
+                    # The model ignored the JSON format; fall back to one request per file
+                    logging.warning("Could not parse batched analysis, retrying files individually")
+                    batch_results = [self._analyze_single(script_paths[i]) for i in indexes]
+            for i, result in zip(indexes, batch_results):
+                results[i] = result
+        
+        return results
+    
+    def analyze_scripts_batch(self, script_paths, batch_size=8):
+        """Analyze scripts in batches, packing up to batch_size files per request.
+        
+        Batches are also capped at MAX_SCRIPT_TOKENS of estimated source.
+        They are sent concurrently and results are returned in input order.
+        """
+        results = [None] * len(script_paths)
+        keys = {}
+        pending = []
+        
+        # Serve unchanged scripts from the cache, hashing files concurrently
+        if self.use_cache and len(script_paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(script_paths), os.cpu_count() or 1)) as executor:
+                lookups = list(executor.map(self._cache_lookup, script_paths))
+        elif self.use_cache:
+            lookups = [self._cache_lookup(path) for path in script_paths]
+        else:
+            lookups = [(None, None)] * len(script_paths)
+        
+        for i, (key, cached) in enumerate(lookups):
+            if key is not None:
+                keys[i] = key
+            if cached is not None:
+                logging.info(f"Using cached analysis for {script_paths[i]}")
+                results[i] = cached
+            else:
+                pending.append(i)
+        
+        if pending:
+            # Pack up to batch_size scripts per request within the token budget
+            batch_size = max(1, batch_size)
+            chunks = []
+            current, current_tokens = [], 0
+            for i in pending:
+                tokens = self._estimate_tokens(script_paths[i])
+                if current and (len(current) >= batch_size or current_tokens + tokens > MAX_SCRIPT_TOKENS):
+                    chunks.append(current)
+                    current, current_tokens = [], 0
+                current.append(i)
+                current_tokens += tokens
+            if current:
+                chunks.append(current)
+            paths = [[script_paths[i] for i in chunk] for chunk in chunks]
+            if len(chunks) == 1:
+                analyses = [self._analyze_chunk(paths[0])]
+            else:
+                workers = max(1, min(MAX_CONCURRENT_ANALYSES, len(chunks)))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    analyses = list(executor.map(self._analyze_chunk, paths))
+            
+            for chunk, chunk_results in zip(chunks, analyses):
+                for i, result in zip(chunk, chunk_results):
+                    results[i] = result
+                    if i in keys and not result.startswith("Error"):
+                        self._cache_set(keys[i], script_paths[i], result)
+        
+        return results
+    
+    def analyze_script(self, script_path):
+        """Analyze a script and suggest optimizations."""
+        return self.analyze_scripts_batch([script_path])[0]
+    
+    def submit_batch(self, script_paths):
+        """Submit analyses for several scripts through the OpenAI Batch API.
         
-        Args:
-            script_path: Path to the script file
-            suggested_changes: Dictionary with keys 'old_code' and 'new_code' for replacements
+        The job runs asynchronously; use collect_batch() with the returned
+        batch id to fetch the results once it has completed.
+        
+        Returns:
+            Dictionary with 'success' and either 'batch_id' or 'error'
+        """
+        if not self.api_key:
+            return {"success": False, "error": "OPENAI_API_KEY is required for batch submissions"}
+        
+        lines = []
+        for script_path in script_paths:
+            try:
+                prompt = self._build_analysis_prompt(script_path)
+            except Exception as e:
+                logging.error(f"Skipping {script_path} in batch: {str(e)}")
+                continue
+            lines.append(json.dumps({
+                "custom_id": script_path,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._build_openai_request(prompt)
+            }))
+        
+        if not lines:
+            return {"success": False, "error": "No readable scripts to submit"}
+        
+        headers = self._openai_headers
+        try:
+            upload = self.session.post(
+                f"{OPENAI_API_BASE}/files",
+                headers=headers,
+                data={"purpose": "batch"},
+                files={"file": ("evolver-batch.jsonl", "\n".join(lines).encode("utf-8"))}
+            )
+            if upload.status_code != 200:
+                logging.error(f"OpenAI file upload error: {upload.text}")
+                return {"success": False, "error": f"Failed to upload batch input. Status code: {upload.status_code}"}
+            
+            response = self.session.post(
+                f"{OPENAI_API_BASE}/batches",
+                headers=headers,
+                json={
+                    "input_file_id": upload.json()["id"],
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": "24h"
+                }
+            )
+            if response.status_code != 200:
+                logging.error(f"OpenAI batch error: {response.text}")
+                return {"success": False, "error": f"Failed to create batch. Status code: {response.status_code}"}
+            
+            batch = response.json()
+        except Exception as e:
+            logging.exception("Error submitting OpenAI batch")
+            return {"success": False, "error": str(e)}
+        
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        with open(os.path.join(BATCH_DIR, f"{batch['id']}.json"), 'w') as f:
+            json.dump({
+                "batch_id": batch["id"],
+                "input_file_id": batch.get("input_file_id"),
+                "scripts": [json.loads(line)["custom_id"] for line in lines],
+                "submitted_at": datetime.now().isoformat()
+            }, f, indent=2)
+        
+        logging.info(f"Submitted batch {batch['id']} with {len(lines)} scripts")
+        return {"success": True, "batch_id": batch["id"], "count": len(lines)}
+    
+    def collect_batch(self, batch_id):
+        """Check a submitted batch and fetch its per-script suggestions when complete.
+        
+        Returns:
+            Dictionary with 'success', 'status' and, once completed, 'results'
+            mapping each script path to its suggestions
+        """
+        if not self.api_key:
+            return {"success": False, "error": "OPENAI_API_KEY is required to collect batches"}
+        
+        headers = self._openai_headers
+        try:
+            response = self.session.get(f"{OPENAI_API_BASE}/batches/{batch_id}", headers=headers)
+            if response.status_code != 200:
+                logging.error(f"OpenAI batch error: {response.text}")
+                return {"success": False, "error": f"Failed to get batch status. Status code: {response.status_code}"}
+            
+            batch = response.json()
+            status = batch.get("status")
+            if status != "completed":
+                return {"success": status not in ("failed", "expired", "cancelled"), "status": status}
+            
+            output = self.session.get(
+                f"{OPENAI_API_BASE}/files/{batch['output_file_id']}/content",
+                headers=headers
+            )
+            if output.status_code != 200:
+                logging.error(f"OpenAI file download error: {output.text}")
+                return {"success": False, "error": f"Failed to download batch output. Status code: {output.status_code}"}
+        except Exception as e:
+            logging.exception(f"Error collecting OpenAI batch {batch_id}")
+            return {"success": False, "error": str(e)}
+        
+        results = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            body = (item.get("response") or {}).get("body") or {}
+            if item.get("error") or "choices" not in body:
+                results[item["custom_id"]] = f"Error: {item.get('error') or body.get('error')}"
+            else:
+                results[item["custom_id"]] = body["choices"][0]["message"]["content"]
+        
+        record_path = os.path.join(BATCH_DIR, f"{batch_id}.json")
+        if os.path.exists(record_path):
+            with open(record_path, 'r') as f:
+                record = json.load(f)
+            record["status"] = status
+            record["results"] = results
+            with open(record_path, 'w') as f:
+                json.dump(record, f, indent=2)
+        
+        logging.info(f"Collected {len(results)} results from batch {batch_id}")
+        return {"success": True, "status": status, "results": results}
+    
+    def extract_diff(self, suggestions):
+        """Return the unified diff contained in a model response, or None."""
+        fenced = _DIFF_FENCE_RE.findall(suggestions)
+        diff = "\n".join(fenced) if fenced else suggestions
+        if not _HUNK_RE.search(diff):
+            return None
+        return diff if diff.endswith("\n") else diff + "\n"
+    
+    def apply_patch(self, script_path, diff, dry_run=False):
+        """Apply a unified diff to a script with patch(1).
+        
+        The patch is checked with --dry-run first so a diff that does not
+        apply cleanly leaves the script untouched.
         
         Returns:
             Tuple of (success, message)
         """
-        logging.info(f"Applying optimizations to {script_path}")
+        if not shutil.which("patch"):
+            return False, "Error: patch is not installed"
         
+        command = ["patch", "--batch", "--forward", "--silent", script_path]
         try:
-            # Create backup first
+            check = subprocess.run(command[:1] + ["--dry-run"] + command[1:],
+                                   input=diff, capture_output=True, text=True)
+            if check.returncode != 0:
+                return False, f"Error: Patch does not apply cleanly: {(check.stdout + check.stderr).strip()}"
+            if dry_run:
+                return True, "Patch applies cleanly"
+            
             backup_path = self.create_backup(script_path)
             if not backup_path:
                 return False, "Failed to create backup"
             
-            # Read current content
-            with open(script_path, 'r') as f:
-                content = f.read()
-            
-            # Apply each change
-            updated_content = content
-            for change in suggested_changes:
-                if 'old_code' in change and 'new_code' in change:
-                    updated_content = updated_content.replace(change['old_code'], change['new_code'])
-            
-            # Write back to file
-            with open(script_path, 'w') as f:
-                f.write(updated_content)
-            
-            logging.info(f"Successfully applied optimizations to {script_path}")
-            return True, f"Optimizations applied. Backup saved at {backup_path}"
+            result = subprocess.run(command, input=diff, capture_output=True, text=True)
+            if result.returncode != 0:
+                shutil.copyfile(backup_path, script_path)
+                return False, f"Error: {(result.stdout + result.stderr).strip()}"
             
+            logging.info(f"Applied patch to {script_path}")
+            return True, f"Patch applied. Backup saved at {backup_path}"
         except Exception as e:
-            logging.exception(f"Error applying optimizations to {script_path}")
+            logging.exception(f"Error applying patch to {script_path}")
             return False, f"Error: {str(e)}"
     
+    def apply_optimization(self, script_path, diff):
+        """Apply a suggested unified diff to a script, backing it up first.
+        
+        Returns:
+            Tuple of (success, message)
+        """
+        logging.info(f"Applying optimizations to {script_path}")
+        return self.apply_patch(script_path, diff)
+    
     def run(self, args=None):
         """Run the self-optimization process."""
         print("\n=== Native OS Self-Optimization ===\n")
@@ -283,12 +1025,16 @@ Output format:
             print("Invalid input. Please enter a number.")
             return
         
-        # Analyze and optimize each selected script
-        for script in selected_scripts:
-            print(f"\nAnalyzing {os.path.basename(script)}...")
-            suggestions = self.analyze_script(script)
-            
-            print("\n=== Optimization Suggestions ===\n")
+        # Analyze all selected scripts concurrently, then review each in turn
+        if len(selected_scripts) > 1:
+            print(f"\nAnalyzing {len(selected_scripts)} scripts...")
+        else:
+            print(f"\nAnalyzing {os.path.basename(selected_scripts[0])}...")
+        analyses = self.analyze_scripts_batch(selected_scripts)
+        
+        accepted = []
+        for script, suggestions in zip(selected_scripts, analyses):
+            print(f"\n=== Optimization Suggestions: {os.path.basename(script)} ===\n")
             print(suggestions)
             
             # Ask if user wants to apply changes
@@ -300,15 +1046,25 @@ Output format:
                 # In a real implementation, we would parse the AI response to get structured changes
                 # Here we simply demonstrate the flow
                 print("\nExtracting suggested code changes...")
-                print("This is a limited demo that would identify specific code blocks to change.")
+                diff = self.extract_diff(suggestions)
+                if diff:
+                    _, message = self.apply_patch(script, diff, dry_run=True)
+                    print(f"Found {len(_HUNK_RE.findall(diff))} hunk(s) in the suggested patch.")
+                    print(message)
+                else:
+                    print("The response did not contain a unified diff.")
                 print("No actual changes will be made in this demo to avoid unexpected modifications.")
-                
-                backup_path = self.create_backup(script)
-                print(f"Created backup at: {backup_path}")
                 print("In a full implementation, changes would be applied here.")
+                accepted.append(script)
             else:
                 print("Optimizations not applied.")
         
+        # Back up every accepted script at once
+        if accepted:
+            print()
+            for script, backup_path in zip(accepted, self.create_backups(accepted)):
+                print(f"Created backup of {os.path.basename(script)} at: {backup_path}")
+        
         print("\nSelf-optimization process completed.")
         return json.dumps({
             "success": True,
@@ -350,32 +1106,54 @@ def main():
     parser.add_argument("--test", action="store_true", help="Run a test to check if the agent is working")
     parser.add_argument("--scan", action="store_true", help="Scan for eligible scripts without analysis")
     parser.add_argument("--analyze", metavar="SCRIPT_PATH", help="Analyze a specific script path")
+    parser.add_argument("--batch", action="store_true", help="Submit all eligible scripts to the OpenAI Batch API")
+    parser.add_argument("--collect-batch", metavar="BATCH_ID", help="Collect the results of a submitted batch")
     args = parser.parse_args()
     
-    agent = Evolver()
-    
-    if args.test:
-        agent.test()
-    elif args.scan:
-        scripts = agent.scan_agent_scripts()
-        if scripts:
-            print(f"Found {len(scripts)} scripts that can be optimized:")
-            for script in scripts:
-                print(f"- {script}")
-        else:
-            print("No eligible scripts found.")
-    elif args.analyze:
-        # Analyze a specific script
-        if os.path.exists(args.analyze):
-            result = agent.analyze_script(args.analyze)
-            print(result)
+    with Evolver() as agent:
+        if args.test:
+            agent.test()
+        elif args.scan:
+            scripts = agent.scan_agent_scripts()
+            if scripts:
+                print(f"Found {len(scripts)} scripts that can be optimized:")
+                for script in scripts:
+                    print(f"- {script}")
+            else:
+                print("No eligible scripts found.")
+        elif args.analyze:
+            # Analyze a specific script
+            if os.path.exists(args.analyze):
+                result = agent.analyze_script(args.analyze)
+                print(result)
+            else:
+                print(f"Error: File not found: {args.analyze}")
+        elif args.batch:
+            scripts = agent.scan_agent_scripts()
+            if not scripts:
+                print("No eligible scripts found.")
+                return
+            result = agent.submit_batch(scripts)
+            if result["success"]:
+                print(f"Submitted {result['count']} scripts as batch {result['batch_id']}")
+                print(f"Collect the results later with: --collect-batch {result['batch_id']}")
+            else:
+                print(f"Error: {result['error']}")
+        elif args.collect_batch:
+            result = agent.collect_batch(args.collect_batch)
+            if not result["success"]:
+                print(f"Error: {result.get('error') or 'Batch ' + result['status']}")
+            elif "results" not in result:
+                print(f"Batch {args.collect_batch} is {result['status']}. Try again later.")
+            else:
+                for script, suggestions in result["results"].items():
+                    print(f"\n=== Optimization Suggestions: {os.path.basename(script)} ===\n")
+                    print(suggestions)
         else:
-            print(f"Error: File not found: {args.analyze}")
-    else:
-        # Interactive mode
-        result = agent.run()
-        if isinstance(result, str):
-            print(result)
+            # Interactive mode
+            result = agent.run()
+            if isinstance(result, str):
+                print(result)
 
 
 if __name__ == "__main__":
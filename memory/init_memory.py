@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
 import os
+import importlib.util
 import sys
 import json
 import logging
+import logging.handlers
+import atexit
+import queue
 import argparse
-import glob
+import time
+import random
+import sqlite3
+import hashlib
+import shutil
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 
@@ -13,8 +23,7 @@ from pathlib import Path
 try:
     import chromadb
     # Use new LangChain imports (v0.2+)
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-    from langchain_community.vectorstores import Chroma
+    from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
     from langchain_openai import OpenAIEmbeddings
     from langchain_community.document_loaders import TextLoader
     HAS_DEPS = True
@@ -22,27 +31,156 @@ except ImportError:
     try:
         # Try older LangChain imports as fallback
         import chromadb
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-        from langchain.vectorstores import Chroma
+        from langchain.text_splitter import RecursiveCharacterTextSplitter, Language
         from langchain.embeddings.openai import OpenAIEmbeddings
         from langchain.document_loaders import TextLoader
         HAS_DEPS = True
     except ImportError:
         HAS_DEPS = False
 
+# Optional tiktoken, used to measure chunk sizes in tokens rather than characters
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
+# Optional numpy, used to write the flat vector index that memory_query.py searches directly
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Optional local embedding model (used when NATIVE_OS_LOCAL_MODEL=1 or no OpenAI key is set). Only its presence is
+# checked here; importing it pulls in torch, so it is imported when the local model is used
+HAS_SENTENCE_TRANSFORMERS = importlib.util.find_spec("sentence_transformers") is not None
+SENTENCE_TRANSFORMERS_MISSING = "sentence-transformers is required for local embeddings. Please install it with: pip install sentence-transformers"
+
 # Setup logging
 LOG_DIR = os.path.expanduser("~/.nativeos/logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "memory.log")
+_log_file_handler = logging.FileHandler(LOG_FILE)
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+# Records are queued and written to the log file on a background thread,
+# so the reader and embedding threads never block on log I/O
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_file_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# Only merge the message arguments here; the file handler applies the full format
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
-    filename=LOG_FILE,
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    handlers=[_log_queue_handler]
 )
+# Per-file messages go through this logger at DEBUG and are only formatted when enabled
+_LOG = logging.getLogger(__name__)
+
+# File types to include (matched case-insensitively)
+FILE_EXTENSIONS = frozenset({
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".html", ".css", ".sh",
+    ".md", ".txt", ".json", ".yaml", ".yml", ".toml"
+})
+
+# Directory names to exclude anywhere in the tree, and project-relative paths to exclude
+EXCLUDE_DIRS = frozenset({
+    "node_modules", "venv", ".git", "__pycache__", "build", "dist", ".nativeos"
+})
+EXCLUDE_PATHS = frozenset({os.path.join("evolver", "backups")})
+
+# Files larger than this are not embedded
+MAX_FILE_SIZE = 1024 * 1024
+
+# Vector store collection shared with memory_query.py
+CHROMA_COLLECTION = "nativeos"
+CHROMA_METADATA = {"hnsw:space": "cosine"}
+# Maximum number of ids per collection delete call
+CHROMA_DELETE_BATCH_SIZE = 5000
+
+# Local embeddings have a different dimension, so they live in their own collection
+LOCAL_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+LOCAL_CHROMA_COLLECTION = "nativeos-local"
+LOCAL_EMBED_BATCH_SIZE = 128
+
+# Flat index of L2-normalized vectors plus chunk metadata, one directory per collection
+FLAT_INDEX_DIR = "flat"
+FLAT_VECTORS_FILE = "vectors.npy"
+FLAT_META_FILE = "meta.json"
+# int8 copy of the vectors with a per-row dequantization factor, scanned first at a quarter
+# of the float32 size; the float32 vectors are only read to re-rank the best candidates
+FLAT_QUANTIZED_FILE = "vectors_q8.npy"
+FLAT_SCALES_FILE = "scales.npy"
+FLAT_QUANT_MAX = 127
+# Above this many chunks Chroma's HNSW index is used instead (the flat index is kept in memory)
+FLAT_INDEX_MAX_ROWS = 20000
+
+# Chunk size and overlap in tokens (OpenAI embedding models use cl100k_base)
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 48
+SPLIT_ENCODING = "cl100k_base"
+# Approximate characters per token, used for chunk sizes when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+# Code is split on language boundaries (classes, functions) without overlap
+LANGUAGE_SPLITTERS = {
+    ".py": Language.PYTHON,
+    ".js": Language.JS,
+    ".jsx": Language.JS,
+    ".ts": Language.TS,
+    ".tsx": Language.TS,
+    ".html": Language.HTML,
+    ".md": Language.MARKDOWN
+} if HAS_DEPS else {}
+
+# Number of chunks embedded per API request
+EMBED_BATCH_SIZE = 256
+
+# Embedding cache keyed by a hash of the model and chunk text (relative to the memory directory)
+EMBED_CACHE_DB = "embed_cache.db"
+# Maximum number of hashes per cache lookup query (SQLite bound-parameter limit)
+EMBED_CACHE_LOOKUP_SIZE = 500
+
+# Threads reading and splitting source files
+READ_WORKERS = 8
+
+# Embedding requests in flight at once, and retry policy for rate-limited batches
+EMBED_WORKERS = 6
+EMBED_MAX_RETRIES = 5
+EMBED_SUBMIT_JITTER = 0.25
+
+class LocalEmbeddings:
+    """SentenceTransformer model exposing the embed_documents/embed_query interface."""
+    
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(SENTENCE_TRANSFORMERS_MISSING)
+        self.model = model_name
+        # Runs on CUDA automatically when a GPU is available
+        self._encoder = SentenceTransformer(model_name)
+    
+    def embed_documents(self, texts):
+        return self._encoder.encode(
+            texts,
+            batch_size=LOCAL_EMBED_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).tolist()
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
 
 class MemoryInitializer:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
+        self.use_local_model = os.getenv("NATIVE_OS_LOCAL_MODEL", "0") == "1"
+        self._embeddings = None
+        self._chroma_client = None
         
         # Project root directory
         self.project_root = self._find_project_root()
@@ -69,42 +207,256 @@ class MemoryInitializer:
         
         return current_dir
     
-    def scan_project_files(self):
-        """Scan all project files for embedding."""
-        project_files = []
-        
-        # File types to include
-        file_extensions = [
-            ".py", ".js", ".jsx", ".ts", ".tsx", ".html", ".css", ".sh",
-            ".md", ".txt", ".json", ".yaml", ".yml", ".toml"
-        ]
-        
-        # Directories to exclude
-        exclude_dirs = [
-            "node_modules", "venv", ".git", "__pycache__", "build", "dist",
-            ".nativeos", "evolver/backups"
-        ]
-        
-        logging.info(f"Scanning project files in {self.project_root}")
+    def _walk_project_files(self, path, rel_path=""):
+        """Yield (device, inode, path) for embeddable files under path (rel_path relative to the project root)."""
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            logging.warning(f"Cannot scan directory {path}: {str(e)}")
+            return
         
-        # Collect files
-        for ext in file_extensions:
-            pattern = os.path.join(self.project_root, f"**/*{ext}")
-            for file_path in glob.glob(pattern, recursive=True):
-                # Check if file is in excluded directory
-                if any(exclude_dir in file_path for exclude_dir in exclude_dirs):
+        for entry in entries:
+            # Hidden files and directories are skipped, as glob("**") did
+            if entry.name.startswith("."):
+                continue
+            
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in EXCLUDE_DIRS:
                     continue
-                
+                # Track the relative path while descending instead of calling relpath per directory
+                child_rel_path = os.path.join(rel_path, entry.name) if rel_path else entry.name
+                if child_rel_path in EXCLUDE_PATHS:
+                    continue
+                yield from self._walk_project_files(entry.path, child_rel_path)
+            # One set lookup on the lowercased suffix; a name without a dot yields its
+            # last character, which never matches
+            elif entry.name[entry.name.rfind("."):].lower() in FILE_EXTENSIONS and entry.is_file():
                 # Ensure file is not too large (max 1MB)
-                if os.path.getsize(file_path) > 1024 * 1024:
-                    logging.info(f"Skipping large file: {file_path}")
+                stat = entry.stat()
+                if stat.st_size > MAX_FILE_SIZE:
+                    if _LOG.isEnabledFor(logging.DEBUG):
+                        _LOG.debug("Skipping large file: %s", entry.path)
                     continue
-                
-                project_files.append(file_path)
+                yield stat.st_dev, stat.st_ino, entry.path
+    
+    def scan_project_files(self):
+        """Scan all project files for embedding."""
+        logging.info(f"Scanning project files in {self.project_root}")
+        
+        # Read files in inode order, which roughly follows their on-disk layout,
+        # so reads are closer to sequential than in directory order
+        project_files = [path for _, _, path in sorted(self._walk_project_files(self.project_root))]
         
         logging.info(f"Found {len(project_files)} files to embed")
         return project_files
     
+    def _is_rate_limited(self, error):
+        """Check whether an embedding error is an HTTP 429 rate-limit response."""
+        status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        return status == 429 or type(error).__name__ == "RateLimitError"
+    
+    def _retry_after(self, error, attempt):
+        """Seconds to wait before retrying, honoring a Retry-After header when present."""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return min(2 ** attempt, 30) + random.uniform(0, 1)
+    
+    def _embed_batch(self, embeddings, texts):
+        """Embed one batch of texts, retrying when the API rate-limits the request."""
+        # Spread out the initial submissions to avoid a burst of simultaneous requests
+        time.sleep(random.uniform(0, EMBED_SUBMIT_JITTER))
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                return embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES or not self._is_rate_limited(e):
+                    raise
+                delay = self._retry_after(e, attempt)
+                logging.warning(f"Embedding batch rate limited, retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
+    def _build_text_splitters(self):
+        """Return {extension: splitter}, with the default splitter under None."""
+        if HAS_TIKTOKEN:
+            encoding = tiktoken.get_encoding(SPLIT_ENCODING)
+            length_function = lambda text: len(encoding.encode(text, disallowed_special=()))
+            chunk_size, chunk_overlap = CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+        else:
+            length_function = len
+            chunk_size, chunk_overlap = CHUNK_TOKENS * CHARS_PER_TOKEN, CHUNK_OVERLAP_TOKENS * CHARS_PER_TOKEN
+        
+        splitters = {
+            None: RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                length_function=length_function
+            )
+        }
+        for extension, language in LANGUAGE_SPLITTERS.items():
+            splitters[extension] = RecursiveCharacterTextSplitter.from_language(
+                language,
+                chunk_size=chunk_size,
+                chunk_overlap=0,
+                length_function=length_function
+            )
+        return splitters
+    
+    def _load_file_chunks(self, text_splitters, file_path):
+        """Read and split one file into chunk documents (empty on error)."""
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                # Files are read once front to back; let the kernel read ahead aggressively
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                content = f.read()
+            
+            # Create metadata
+            rel_path = os.path.relpath(file_path, self.project_root)
+            extension = os.path.splitext(file_path)[1]
+            file_type = extension[1:]
+            text_splitter = text_splitters.get(extension.lower(), text_splitters[None])
+            
+            # Split text into chunks
+            documents = [
+                {
+                    "content": chunk,
+                    "metadata": {
+                        "source": rel_path,
+                        "file_type": file_type,
+                        "chunk": i
+                    }
+                }
+                for i, chunk in enumerate(text_splitter.split_text(content))
+            ]
+            
+            if _LOG.isEnabledFor(logging.DEBUG):
+                _LOG.debug("Processed file: %s", rel_path)
+            return documents
+        except Exception as e:
+            logging.error(f"Error processing file {file_path}: {str(e)}")
+            return []
+    
+    def _get_embeddings(self):
+        """Return the embedding backend, or None if neither a local model nor an API key is available."""
+        if self._embeddings is None:
+            if HAS_SENTENCE_TRANSFORMERS and (self.use_local_model or not self.api_key):
+                logging.info(f"Using local embedding model {LOCAL_EMBEDDING_MODEL}")
+                self._embeddings = LocalEmbeddings()
+            elif self.api_key:
+                # Use OpenAI embeddings
+                self._embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
+        return self._embeddings
+    
+    def _get_chroma_client(self):
+        """Open the persisted Chroma client once and share it between indexing and queries."""
+        if self._chroma_client is None:
+            self._chroma_client = chromadb.PersistentClient(path=os.path.join(self.memory_dir, "chroma"))
+        return self._chroma_client
+    
+    def _collection_name(self, embeddings):
+        """Return the collection holding vectors from this embedding backend."""
+        return LOCAL_CHROMA_COLLECTION if isinstance(embeddings, LocalEmbeddings) else CHROMA_COLLECTION
+    
+    def _open_embed_cache(self):
+        """Open the embedding cache database, or return None if it is unavailable."""
+        try:
+            conn = sqlite3.connect(os.path.join(self.memory_dir, EMBED_CACHE_DB))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Cached vectors go back into the collection, so they are kept at full precision
+            conn.execute("DROP TABLE IF EXISTS cache_q8")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (h BLOB PRIMARY KEY, vec BLOB)")
+            return conn
+        except sqlite3.Error as e:
+            logging.warning(f"Embedding cache disabled: {str(e)}")
+            return None
+    
+    def _chunk_hash(self, model, text):
+        """Hash a chunk together with the embedding model that produced its vector."""
+        return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=16).digest()
+    
+    def _cache_lookup(self, conn, hashes):
+        """Return {hash: vector} for the hashes present in the embedding cache."""
+        found = {}
+        for start in range(0, len(hashes), EMBED_CACHE_LOOKUP_SIZE):
+            chunk = hashes[start:start + EMBED_CACHE_LOOKUP_SIZE]
+            rows = conn.execute(
+                f"SELECT h, vec FROM cache WHERE h IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for h, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[h] = vector.tolist()
+        return found
+    
+    def _cache_store(self, conn, hashes, vectors):
+        """Store embedding vectors as packed float32 blobs."""
+        conn.executemany(
+            "INSERT OR REPLACE INTO cache (h, vec) VALUES (?, ?)",
+            [(h, array("f", vector).tobytes()) for h, vector in zip(hashes, vectors)]
+        )
+        conn.commit()
+    
+    def _upsert_documents(self, collection, documents, vectors):
+        """Write chunk documents and their vectors to the collection; returns their ids."""
+        ids = [f"{doc['metadata']['source']}:{doc['metadata']['chunk']}" for doc in documents]
+        collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[doc["content"] for doc in documents],
+            metadatas=[doc["metadata"] for doc in documents]
+        )
+        return ids
+    
+    def _delete_stale_chunks(self, collection, current_ids):
+        """Delete chunks not written by this run (removed files, files that shrank or were re-chunked)."""
+        stale = [chunk_id for chunk_id in collection.get(include=[])["ids"] if chunk_id not in current_ids]
+        for start in range(0, len(stale), CHROMA_DELETE_BATCH_SIZE):
+            collection.delete(ids=stale[start:start + CHROMA_DELETE_BATCH_SIZE])
+        if stale:
+            logging.info(f"Deleted {len(stale)} stale chunks from the collection")
+    
+    def _write_flat_index(self, collection_name, documents, blocks):
+        """Save normalized vectors (float32 blocks) and chunk metadata for brute-force search in memory_query.py."""
+        index_dir = os.path.join(self.memory_dir, FLAT_INDEX_DIR, collection_name)
+        if not documents:
+            self._remove_flat_index(collection_name)
+            return
+        os.makedirs(index_dir, exist_ok=True)
+        
+        matrix = np.vstack(blocks)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        
+        # Symmetric per-row int8 quantization; scales hold the factor that restores each row
+        scales = np.abs(matrix).max(axis=1)
+        scales[scales == 0] = 1.0
+        quantized = np.round(matrix / scales[:, None] * FLAT_QUANT_MAX).astype(np.int8)
+        scales = (scales / FLAT_QUANT_MAX).astype(np.float32)
+        
+        # Write to temporary files first so a concurrent query never sees a partial index;
+        # the metadata file is replaced last and marks a new version
+        arrays = {FLAT_VECTORS_FILE: matrix, FLAT_QUANTIZED_FILE: quantized, FLAT_SCALES_FILE: scales}
+        for name, data in arrays.items():
+            with open(os.path.join(index_dir, name + ".tmp"), "wb") as f:
+                np.save(f, data)
+        meta_path = os.path.join(index_dir, FLAT_META_FILE)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump([{"content": doc["content"], "metadata": doc["metadata"]} for doc in documents], f)
+        for name in arrays:
+            os.replace(os.path.join(index_dir, name + ".tmp"), os.path.join(index_dir, name))
+        os.replace(meta_path + ".tmp", meta_path)
+        logging.info(f"Wrote flat index with {len(documents)} vectors to {index_dir}")
+    
+    def _remove_flat_index(self, collection_name):
+        """Delete a flat index so queries fall back to the Chroma collection."""
+        index_dir = os.path.join(self.memory_dir, FLAT_INDEX_DIR, collection_name)
+        if os.path.isdir(index_dir):
+            shutil.rmtree(index_dir, ignore_errors=True)
+            logging.info(f"Removed flat index {index_dir}; queries will use Chroma")
+    
     def create_embeddings(self, files):
         """Create embeddings for the given files."""
         if not HAS_DEPS:
@@ -113,60 +465,128 @@ class MemoryInitializer:
         logging.info("Creating embeddings...")
         
         try:
-            if self.api_key:
-                # Use OpenAI embeddings
-                embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
-            else:
+            embeddings = self._get_embeddings()
+            if embeddings is None:
                 logging.error("No OpenAI API key found. Cannot create embeddings.")
                 print("Error: OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
                 return False
             
-            # Document loader and text splitter
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
+            # Token-sized text splitters, language-aware for code
+            text_splitters = self._build_text_splitters()
             
-            # Process each file
-            documents = []
-            for file_path in files:
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                    
-                    # Create metadata
-                    rel_path = os.path.relpath(file_path, self.project_root)
-                    file_type = os.path.splitext(file_path)[1][1:]
-                    
-                    # Split text into chunks
-                    chunks = text_splitter.split_text(content)
+            collection_name = self._collection_name(embeddings)
+            client = self._get_chroma_client()
+            collection = client.get_or_create_collection(collection_name, metadata=CHROMA_METADATA)
+            
+            # Unchanged chunks reuse their cached vectors instead of being re-embedded
+            cache = self._open_embed_cache()
+            model = getattr(embeddings, "model", "")
+            
+            # Pipeline: reader threads load and split files while embedding workers
+            # process full batches as soon as enough chunks are available
+            total = 0
+            pending = []
+            cached_docs = []
+            cached_vectors = []
+            futures = {}
+            # Chunks whose text is already queued for embedding, keyed by hash; they reuse its vector
+            duplicates = {}
+            # Every chunk of this run, in the order stored, for the flat index. Vectors are kept as
+            # float32 blocks, and collection stops once the run exceeds FLAT_INDEX_MAX_ROWS
+            flat_docs = []
+            flat_blocks = []
+            write_flat = HAS_NUMPY
+            
+            def add_to_flat_index(documents, vectors):
+                nonlocal write_flat
+                if not write_flat:
+                    return
+                if len(flat_docs) + len(documents) > FLAT_INDEX_MAX_ROWS:
+                    write_flat = False
+                    flat_docs.clear()
+                    flat_blocks.clear()
+                    return
+                flat_docs.extend(documents)
+                flat_blocks.append(np.asarray(vectors, dtype=np.float32))
+            
+            def store_cached():
+                # Cached chunks are stored a batch at a time so their vectors are not all held at once
+                stored_ids.update(self._upsert_documents(collection, cached_docs, cached_vectors))
+                add_to_flat_index(cached_docs, cached_vectors)
+                cached_docs.clear()
+                cached_vectors.clear()
+            
+            reused = 0
+            # Ids written by this run; anything else in the collection is stale afterwards
+            stored_ids = set()
+            with ThreadPoolExecutor(max_workers=READ_WORKERS) as readers, \
+                    ThreadPoolExecutor(max_workers=1 if isinstance(embeddings, LocalEmbeddings) else EMBED_WORKERS) as embedders:
+                for documents in readers.map(lambda path: self._load_file_chunks(text_splitters, path), files):
+                    total += len(documents)
+                    for doc in documents:
+                        doc["hash"] = self._chunk_hash(model, doc["content"])
+                    hits = self._cache_lookup(cache, [doc["hash"] for doc in documents]) if cache is not None and documents else {}
+                    for doc in documents:
+                        if doc["hash"] in hits:
+                            cached_docs.append(doc)
+                            cached_vectors.append(hits[doc["hash"]])
+                            reused += 1
+                            if len(cached_docs) >= EMBED_BATCH_SIZE:
+                                store_cached()
+                        elif doc["hash"] in duplicates:
+                            # Shared boilerplate (license headers, imports) is embedded only once
+                            duplicates[doc["hash"]].append(doc)
+                        else:
+                            duplicates[doc["hash"]] = []
+                            pending.append(doc)
                     
-                    # Add chunks to documents
-                    for i, chunk in enumerate(chunks):
-                        documents.append({
-                            "content": chunk,
-                            "metadata": {
-                                "source": rel_path,
-                                "file_type": file_type,
-                                "chunk": i
-                            }
-                        })
+                    while len(pending) >= EMBED_BATCH_SIZE:
+                        batch, pending = pending[:EMBED_BATCH_SIZE], pending[EMBED_BATCH_SIZE:]
+                        futures[embedders.submit(self._embed_batch, embeddings, [doc["content"] for doc in batch])] = batch
+                if pending:
+                    futures[embedders.submit(self._embed_batch, embeddings, [doc["content"] for doc in pending])] = pending
+                
+                # Store the remaining cached chunks, then each new batch as soon as its embeddings arrive
+                if cached_docs:
+                    store_cached()
+                if reused:
+                    logging.info(f"Reused cached embeddings for {reused}/{total} chunks")
+                
+                duplicate_count = sum(len(docs) for docs in duplicates.values())
+                if duplicate_count:
+                    logging.info(f"Skipping {duplicate_count} duplicate chunks during embedding")
+                
+                embedded = reused
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    vectors = future.result()
+                    if cache is not None:
+                        self._cache_store(cache, [doc["hash"] for doc in batch], vectors)
                     
-                    logging.info(f"Processed file: {rel_path}")
-                except Exception as e:
-                    logging.error(f"Error processing file {file_path}: {str(e)}")
+                    # Fan each vector out to the duplicate chunks that share its text
+                    stored_docs = list(batch)
+                    stored_vectors = list(vectors)
+                    for doc, vector in zip(batch, vectors):
+                        for duplicate in duplicates[doc["hash"]]:
+                            stored_docs.append(duplicate)
+                            stored_vectors.append(vector)
+                    stored_ids.update(self._upsert_documents(collection, stored_docs, stored_vectors))
+                    add_to_flat_index(stored_docs, stored_vectors)
+                    embedded += len(stored_docs)
+                    logging.info(f"Embedded {embedded}/{total} chunks")
             
-            # Create vector store
-            vectorstore = Chroma.from_documents(
-                documents=[{"page_content": doc["content"], "metadata": doc["metadata"]} for doc in documents],
-                embedding=embeddings,
-                persist_directory=os.path.join(self.memory_dir, "chroma")
-            )
+            if cache is not None:
+                cache.close()
+            
+            # Keep the collection in line with the flat index, which only holds this run's chunks
+            self._delete_stale_chunks(collection, stored_ids)
             
-            # Persist the database
-            vectorstore.persist()
+            if write_flat:
+                self._write_flat_index(collection_name, flat_docs, flat_blocks)
+            elif HAS_NUMPY:
+                self._remove_flat_index(collection_name)
             
-            logging.info(f"Created embeddings for {len(documents)} documents")
+            logging.info(f"Created embeddings for {total} documents")
             return True
         
         except Exception as e:
@@ -180,28 +600,33 @@ class MemoryInitializer:
             return "Error: Required dependencies not found."
         
         try:
-            if self.api_key:
-                # Use OpenAI embeddings
-                embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
-            else:
+            embeddings = self._get_embeddings()
+            if embeddings is None:
                 return "Error: OpenAI API key not found."
             
-            # Load the persisted vector store
-            vectorstore = Chroma(
-                persist_directory=os.path.join(self.memory_dir, "chroma"),
-                embedding_function=embeddings
-            )
+            # Load the persisted collection
+            client = self._get_chroma_client()
+            try:
+                collection = client.get_collection(self._collection_name(embeddings))
+            except Exception:
+                return "Error: Memory database not found. Please run memory initialization first."
             
             # Query the database
-            results = vectorstore.similarity_search(query, k=5)
+            results = collection.query(
+                query_embeddings=[embeddings.embed_query(query)],
+                n_results=5,
+                include=["documents", "metadatas", "distances"]
+            )
             
-            # Format results
+            # Format results (cosine distance, so similarity is 1 - distance)
             response = []
-            for doc in results:
+            for content, metadata, distance in zip(
+                results["documents"][0], results["metadatas"][0], results["distances"][0]
+            ):
                 response.append({
-                    "content": doc.page_content,
-                    "source": doc.metadata.get("source", "Unknown"),
-                    "similarity": doc.metadata.get("score", 0)
+                    "content": content,
+                    "source": (metadata or {}).get("source", "Unknown"),
+                    "similarity": 1 - distance
                 })
             
             return response
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import importlib.util
 import sys
 import json
 import logging
 import argparse
 import time
+import functools
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from pathlib import Path
 
@@ -15,7 +21,6 @@ try:
     import chromadb
     # Use new LangChain imports (v0.2+)
     from langchain_text_splitters import RecursiveCharacterTextSplitter
-    from langchain_community.vectorstores import Chroma
     from langchain_openai import OpenAIEmbeddings
     from langchain_community.document_loaders import TextLoader
     HAS_DEPS = True
@@ -24,13 +29,31 @@ except ImportError:
         # Try older LangChain imports as fallback
         import chromadb
         from langchain.text_splitter import RecursiveCharacterTextSplitter
-        from langchain.vectorstores import Chroma
         from langchain.embeddings.openai import OpenAIEmbeddings
         from langchain.document_loaders import TextLoader
         HAS_DEPS = True
     except ImportError:
         HAS_DEPS = False
 
+# Optional numpy, used to search the flat vector index written by init_memory.py
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Optional orjson for faster encoding of request bodies and decoding of streamed events
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Optional local embedding model, matching the one init_memory.py uses. Only its presence is
+# checked here; importing it pulls in torch, so it is imported when the local model is used
+HAS_SENTENCE_TRANSFORMERS = importlib.util.find_spec("sentence_transformers") is not None
+SENTENCE_TRANSFORMERS_MISSING = "sentence-transformers is required for local embeddings. Please install it with: pip install sentence-transformers"
+
 # Setup logging
 LOG_DIR = os.path.expanduser("~/.nativeos/logs")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -41,10 +64,121 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Vector store collection written by init_memory.py
+CHROMA_COLLECTION = "nativeos"
+
+# Collection and model used when init_memory.py embedded with the local model
+LOCAL_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+LOCAL_CHROMA_COLLECTION = "nativeos-local"
+
+# Flat index written by init_memory.py (one directory per collection)
+FLAT_INDEX_DIR = "flat"
+FLAT_VECTORS_FILE = "vectors.npy"
+FLAT_META_FILE = "meta.json"
+FLAT_QUANTIZED_FILE = "vectors_q8.npy"
+FLAT_SCALES_FILE = "scales.npy"
+# Rows of the int8 matrix widened to float32 at a time while scoring
+FLAT_SCORE_BLOCK = 4096
+# Candidates from the int8 scan that are re-ranked against the float32 vectors
+FLAT_RERANK_CANDIDATES = 50
+# Larger indexes are searched through Chroma's HNSW index (matches init_memory.py)
+FLAT_INDEX_MAX_ROWS = 20000
+
+# Results with a larger cosine distance are left out of the context
+MAX_DISTANCE = 0.5
+
+# Model used for answers when the local model is not in use
+OPENAI_MODEL = "gpt-4"
+
+# System prompt for OpenAI answers. It is built once and always sent first, so the
+# stable prefix of every request qualifies for OpenAI's prompt caching
+SYSTEM_PROMPT = """You are a memory and context-aware assistant created by hxcode ai for the Native OS project. Your purpose is to provide relevant information from the project's codebase and context to help developers with their tasks.
+
+Your capabilities:
+1. Recall specific code implementations, configurations, and documentation
+2. Understand the project structure and relationships between components
+3. Answer questions about how the system works based on the provided context
+4. Provide relevant code snippets and file references when appropriate
+5. Maintain awareness of the project's architecture and design patterns
+
+Guidelines:
+- Always cite your sources by providing file paths when referencing code or information
+- Be precise in your explanations, focusing on the most relevant information
+- When providing code snippets, include enough context to understand the implementation
+- Acknowledge knowledge gaps rather than making up information
+- Organize responses in a clear, structured manner with appropriate headings and sections
+- Focus on the most relevant information based on similarity scores
+
+Additional context awareness:
+- Prioritize recently created or modified files when relevant to the query
+- Consider the interrelationships between different components and files
+- Understand the tech stack and frameworks used in the Native OS project
+- Be aware of the project's overall architecture and design philosophy
+- Factor in the importance of files based on their centrality to the codebase"""
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# (connect, read) timeout for model requests
+REQUEST_TIMEOUT = (3, 30)
+
+# Queries run concurrently by --test
+TEST_QUERIES = (
+    "What are the main components of Native OS?",
+    "How is the project memory initialized?",
+    "How does the evolver optimize agent scripts?"
+)
+
+# Shared session so repeated queries reuse pooled connections instead of
+# reconnecting (and redoing the TLS handshake) for every request
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset(["POST"])
+    )
+)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+# Every request body is JSON, serialized with _json_dumps
+_SESSION.headers["Content-Type"] = "application/json"
+
+_json_loads = orjson.loads if HAS_ORJSON else json.loads
+
+def _json_dumps(obj):
+    """Serialize obj to UTF-8 JSON bytes, using orjson when it is installed."""
+    return orjson.dumps(obj) if HAS_ORJSON else json.dumps(obj).encode("utf-8")
+
+@functools.lru_cache(maxsize=None)
+def _get_collection(chroma_path, collection_name):
+    """Open a persisted collection once per process."""
+    return chromadb.PersistentClient(path=chroma_path).get_collection(collection_name)
+
+@functools.lru_cache(maxsize=4)
+def _read_flat_index(index_dir, version):
+    """Load a flat index once per version (the mtime of its metadata file, which is written last).
+    
+    Returns None for indexes above FLAT_INDEX_MAX_ROWS without reading their metadata.
+    """
+    quantized = np.load(os.path.join(index_dir, FLAT_QUANTIZED_FILE), mmap_mode="r")
+    if quantized.shape[0] > FLAT_INDEX_MAX_ROWS:
+        return None
+    scales = np.load(os.path.join(index_dir, FLAT_SCALES_FILE))
+    matrix = np.load(os.path.join(index_dir, FLAT_VECTORS_FILE), mmap_mode="r")
+    with open(os.path.join(index_dir, FLAT_META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    return quantized, scales, matrix, meta
+
 class MemoryQuery:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.use_local_model = os.getenv("NATIVE_OS_LOCAL_MODEL", "0") == "1" or self.api_key is None
+        self._local_encoder = None
+        self._openai_embeddings = None
+        # Concurrent queries (--test) must not load the embedding model more than once
+        self._embeddings_lock = threading.Lock()
         
         # Project root directory
         self.project_root = self._find_project_root()
@@ -70,30 +204,125 @@ class MemoryQuery:
         
         return current_dir
     
-    def _get_ollama_response(self, prompt):
-        """Get response from local Ollama model."""
+    def _get_local_encoder(self):
+        """Load the local SentenceTransformer model once."""
+        with self._embeddings_lock:
+            if self._local_encoder is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise ImportError(SENTENCE_TRANSFORMERS_MISSING)
+                self._local_encoder = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
+        return self._local_encoder
+    
+    def _get_openai_embeddings(self):
+        """Create the OpenAI embeddings client once."""
+        with self._embeddings_lock:
+            if self._openai_embeddings is None:
+                self._openai_embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
+        return self._openai_embeddings
+    
+    def _load_flat_index(self, collection_name):
+        """Load the flat vector index as (quantized, scales, matrix, metadata), or None if it is unavailable."""
+        if not HAS_NUMPY:
+            return None
+        
+        index_dir = os.path.join(self.memory_dir, FLAT_INDEX_DIR, collection_name)
+        try:
+            version = os.stat(os.path.join(index_dir, FLAT_META_FILE)).st_mtime_ns
+            flat_index = _read_flat_index(index_dir, version)
+        except (OSError, ValueError):
+            return None
+        if flat_index is None:
+            return None
+        
+        quantized, scales, matrix, meta = flat_index
+        if not len(meta) == quantized.shape[0] == scales.shape[0] == matrix.shape[0]:
+            logging.warning(f"Flat index in {index_dir} is inconsistent, falling back to Chroma")
+            return None
+        return flat_index
+    
+    def _search_flat_index(self, flat_index, query_embedding, max_results):
+        """Return the closest chunks as (content, metadata, cosine distance) tuples."""
+        quantized, scales, matrix, meta = flat_index
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        
+        # Approximate cosine similarities from the int8 rows (stored L2-normalized), widening
+        # one block at a time so the full matrix is never copied to float32
+        approximate = np.empty(len(quantized), dtype=np.float32)
+        for start in range(0, len(quantized), FLAT_SCORE_BLOCK):
+            block = quantized[start:start + FLAT_SCORE_BLOCK]
+            approximate[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        approximate *= scales
+        
+        # Select candidates without sorting the whole corpus
+        candidate_count = max(max_results, FLAT_RERANK_CANDIDATES)
+        if candidate_count < len(approximate):
+            candidates = np.argpartition(-approximate, candidate_count)[:candidate_count]
+        else:
+            candidates = np.arange(len(approximate))
+        
+        # Re-rank only the candidates against their float32 vectors (read in file order), then order the top k
+        candidates = np.sort(candidates)
+        similarities = matrix[candidates] @ query_vector
+        top = np.argsort(-similarities)[:max_results]
+        return [
+            (meta[candidates[j]]["content"], meta[candidates[j]]["metadata"], 1.0 - float(similarities[j]))
+            for j in top
+        ]
+    
+    def _prewarm_ollama(self):
+        """Ask Ollama to load the model so generation does not wait for it."""
         try:
-            # Check if Ollama is running
-            response = requests.post(
+            # A request without a prompt only loads the model into memory
+            _SESSION.post(
                 "http://localhost:11434/api/generate",
-                json={
+                data=_json_dumps({"model": "llama2"}),
+                timeout=REQUEST_TIMEOUT
+            )
+        except Exception as e:
+            logging.warning(f"Could not prewarm Ollama: {str(e)}")
+    
+    def _get_ollama_response(self, prompt, on_token=None):
+        """Get response from local Ollama model, passing each token to on_token as it arrives."""
+        try:
+            # Check if Ollama is running; tokens are streamed back as NDJSON
+            with _SESSION.post(
+                "http://localhost:11434/api/generate",
+                data=_json_dumps({
                     "model": "llama2",
                     "prompt": prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                return response.json().get("response", "")
-            else:
-                logging.error(f"Ollama error: {response.text}")
-                return f"Error: Failed to get response from local model. Status code: {response.status_code}"
+                    "stream": True
+                }),
+                timeout=REQUEST_TIMEOUT,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logging.error(f"Ollama error: {response.text}")
+                    return f"Error: Failed to get response from local model. Status code: {response.status_code}"
+                
+                chunks = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = _json_loads(line)
+                    if event.get("error"):
+                        logging.error(f"Ollama error: {event['error']}")
+                        return f"Error: Local model failed: {event['error']}"
+                    token = event.get("response", "")
+                    if token and on_token:
+                        on_token(token)
+                    chunks.append(token)
+                    if event.get("done"):
+                        break
+                return "".join(chunks)
         except Exception as e:
             logging.exception("Error connecting to Ollama")
             return f"Error: Could not connect to Ollama. Is it running? Error: {str(e)}"
     
-    def _get_openai_response(self, prompt):
-        """Get response from OpenAI API."""
+    def _get_openai_response(self, prompt, on_token=None):
+        """Get response from OpenAI API, passing each token to on_token as it arrives."""
         try:
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
@@ -101,53 +330,46 @@ class MemoryQuery:
             }
             
             data = {
-                "model": "gpt-4",
+                "model": OPENAI_MODEL,
                 "messages": [
-                    {"role": "system", "content": """You are a memory and context-aware assistant created by hxcode ai for the Native OS project. Your purpose is to provide relevant information from the project's codebase and context to help developers with their tasks.
-
-Your capabilities:
-1. Recall specific code implementations, configurations, and documentation
-2. Understand the project structure and relationships between components
-3. Answer questions about how the system works based on the provided context
-4. Provide relevant code snippets and file references when appropriate
-5. Maintain awareness of the project's architecture and design patterns
-
-Guidelines:
-- Always cite your sources by providing file paths when referencing code or information
-- Be precise in your explanations, focusing on the most relevant information
-- When providing code snippets, include enough context to understand the implementation
-- Acknowledge knowledge gaps rather than making up information
-- Organize responses in a clear, structured manner with appropriate headings and sections
-- Focus on the most relevant information based on similarity scores
-
-Additional context awareness:
-- Prioritize recently created or modified files when relevant to the query
-- Consider the interrelationships between different components and files
-- Understand the tech stack and frameworks used in the Native OS project
-- Be aware of the project's overall architecture and design philosophy
-- Factor in the importance of files based on their centrality to the codebase"""},
+                    _SYSTEM_MESSAGE,
                     {"role": "user", "content": prompt}
                 ],
-                "temperature": 0.3
+                "temperature": 0.3,
+                "stream": True
             }
             
-            response = requests.post(
+            # Tokens arrive as server-sent events until "data: [DONE]"
+            with _SESSION.post(
                 "https://api.openai.com/v1/chat/completions",
                 headers=headers,
-                json=data
-            )
-            
-            if response.status_code == 200:
-                return response.json()["choices"][0]["message"]["content"]
-            else:
-                logging.error(f"OpenAI error: {response.text}")
-                return f"Error: Failed to get response from OpenAI. Status code: {response.status_code}"
+                data=_json_dumps(data),
+                timeout=REQUEST_TIMEOUT,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logging.error(f"OpenAI error: {response.text}")
+                    return f"Error: Failed to get response from OpenAI. Status code: {response.status_code}"
+                
+                chunks = []
+                for line in response.iter_lines():
+                    if not line or not line.startswith(b"data: "):
+                        continue
+                    payload = line[len(b"data: "):]
+                    if payload == b"[DONE]":
+                        break
+                    choices = _json_loads(payload).get("choices") or [{}]
+                    token = choices[0].get("delta", {}).get("content") or ""
+                    if token and on_token:
+                        on_token(token)
+                    chunks.append(token)
+                return "".join(chunks)
         except Exception as e:
             logging.exception("Error connecting to OpenAI")
             return f"Error: {str(e)}"
     
-    def query_memory(self, query, max_results=8):
-        """Query the memory system and enhance results."""
+    def query_memory(self, query, max_results=8, on_token=None):
+        """Query the memory system and enhance results, streaming answer tokens to on_token if given."""
         if not HAS_DEPS:
             return "Error: Required dependencies not found."
         
@@ -157,30 +379,60 @@ Additional context awareness:
             if not os.path.exists(chroma_path):
                 return "Error: Memory database not found. Please run memory initialization first."
             
-            if self.api_key:
+            if HAS_SENTENCE_TRANSFORMERS and self.use_local_model:
+                # Embed the query with the same local model the collection was built with
+                collection_name = LOCAL_CHROMA_COLLECTION
+                embed_query = lambda: self._get_local_encoder().encode(
+                    [query], normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+                )[0].tolist()
+            elif self.api_key:
                 # Use OpenAI embeddings
-                embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
+                collection_name = CHROMA_COLLECTION
+                embed_query = lambda: self._get_openai_embeddings().embed_query(query)
             else:
                 return "Error: OpenAI API key not found."
             
-            # Load the persisted vector store
-            vectorstore = Chroma(
-                persist_directory=chroma_path,
-                embedding_function=embeddings
-            )
+            # Embed the query and warm up the local model while the collection loads
+            pool = ThreadPoolExecutor(max_workers=2)
+            try:
+                embedding_future = pool.submit(embed_query)
+                if self.use_local_model:
+                    pool.submit(self._prewarm_ollama)
+                
+                # Small corpora are searched directly in the flat index; otherwise load the collection
+                flat_index = self._load_flat_index(collection_name)
+                if flat_index is None:
+                    try:
+                        collection = _get_collection(chroma_path, collection_name)
+                    except Exception:
+                        return "Error: Memory database not found. Please run memory initialization first."
+                
+                query_embedding = embedding_future.result()
+            finally:
+                # Do not wait for the prewarm request; generation queues behind it in Ollama anyway
+                pool.shutdown(wait=False)
             
             # Query the database
-            results = vectorstore.similarity_search_with_score(query, k=max_results)
+            if flat_index is not None:
+                matches = self._search_flat_index(flat_index, query_embedding, max_results)
+            else:
+                results = collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=max_results,
+                    include=["documents", "metadatas", "distances"]
+                )
+                matches = zip(results["documents"][0], results["metadatas"][0], results["distances"][0])
             
             # Format results for context assembly
             context_parts = []
             sources = []
             
-            for doc, score in results:
-                # Only include results with good similarity (lower score is better)
-                if score < 1.0:  # Adjust threshold as needed
-                    context_parts.append(f"Source: {doc.metadata.get('source', 'Unknown')}\n\nContent:\n{doc.page_content}\n")
-                    sources.append(doc.metadata.get('source', 'Unknown'))
+            for content, metadata, distance in matches:
+                # Only include results with good similarity (lower distance is better)
+                if distance < MAX_DISTANCE:  # Adjust threshold as needed
+                    source = (metadata or {}).get('source', 'Unknown')
+                    context_parts.append(f"Source: {source}\n\nContent:\n{content}\n")
+                    sources.append(source)
             
             # Create context from results
             context = "\n---\n".join(context_parts)
@@ -202,15 +454,15 @@ Provide specific file paths and code references where appropriate.
             # Get enhanced response from language model
             if self.use_local_model:
                 logging.info("Using local Ollama model for query enhancement")
-                response = self._get_ollama_response(enhanced_prompt)
+                response = self._get_ollama_response(enhanced_prompt, on_token)
             else:
                 logging.info("Using OpenAI API for query enhancement")
-                response = self._get_openai_response(enhanced_prompt)
+                response = self._get_openai_response(enhanced_prompt, on_token)
             
             # Return enhanced response with sources
             return {
                 "answer": response,
-                "sources": list(set(sources)),  # Deduplicate sources
+                "sources": list(dict.fromkeys(sources)),  # Deduplicate sources, keeping rank order
                 "raw_context": context
             }
         
@@ -229,16 +481,28 @@ Provide specific file paths and code references where appropriate.
         print(f"\n📚 Searching Native OS memory for: '{query}'")
         start_time = time.time()
         
+        # Print the answer as it streams in, starting with the time to the first token
+        streamed = []
+        def write_token(token):
+            if not streamed:
+                print(f"\n=== Answer (first token: {time.time() - start_time:.2f}s) ===\n")
+            streamed.append(token)
+            sys.stdout.write(token)
+            sys.stdout.flush()
+        
         # Query memory
-        result = self.query_memory(query)
+        result = self.query_memory(query, on_token=write_token)
         
         # Calculate query time
         query_time = time.time() - start_time
         
         # Format and display results
         if isinstance(result, dict) and "answer" in result:
-            print(f"\n=== Answer (query time: {query_time:.2f}s) ===\n")
-            print(result["answer"])
+            if streamed:
+                print(f"\n\n(query time: {query_time:.2f}s)")
+            else:
+                print(f"\n=== Answer (query time: {query_time:.2f}s) ===\n")
+                print(result["answer"])
             
             print("\n=== Sources ===")
             for source in result["sources"]:
@@ -246,12 +510,11 @@ Provide specific file paths and code references where appropriate.
         else:
             print(result)  # Display error message
         
-        return json.dumps(result) if isinstance(result, dict) else json.dumps({"error": result})
+        return _json_dumps(result if isinstance(result, dict) else {"error": result}).decode("utf-8")
     
     def test(self):
         """Run a test to check if the memory query is working."""
         print("Testing Memory Query System...")
-        test_query = "What are the main components of Native OS?"
         
         try:
             # Check if memory exists
@@ -260,17 +523,23 @@ Provide specific file paths and code references where appropriate.
                 print("⚠️ Memory database not found. Please run memory initialization first.")
                 return False
             
-            # Attempt a test query
-            result = self.query_memory(test_query, max_results=3)
+            # Attempt the test queries concurrently
+            with ThreadPoolExecutor(max_workers=len(TEST_QUERIES)) as executor:
+                results = list(executor.map(
+                    lambda test_query: self.query_memory(test_query, max_results=3), TEST_QUERIES
+                ))
             
-            if isinstance(result, dict) and "answer" in result:
+            failed = [result for result in results if not (isinstance(result, dict) and "answer" in result)]
+            if not failed:
                 print("✅ Test successful - memory query system works!")
-                print(f"- Found {len(result.get('sources', []))} relevant sources")
-                print("- Sample answer beginning:", result["answer"][:100] + "...")
+                for test_query, result in zip(TEST_QUERIES, results):
+                    print(f"- '{test_query}': found {len(result.get('sources', []))} relevant sources")
+                print("- Sample answer beginning:", results[0]["answer"][:100] + "...")
                 return True
             else:
                 print("⚠️ Test completed, but no proper result was returned")
-                print(result)
+                for result in failed:
+                    print(result)
                 return False
         except Exception as e:
             print(f"❌ Test failed: {str(e)}")